@@ -0,0 +1,88 @@
+"""Benchmark cold start of a web worker
+
+Imports the WSGI app in fresh interpreters, the way gunicorn does, and reports import time (from python -X
+importtime), peak RSS, and any plotting/science modules that were loaded. Exits with an error if one of them was,
+as web workers should only load them on a plot or ingestion path.
+
+Run from the project root, in the same environment as the API:
+
+    python benchmarks/import_benchmark.py --repeat 5
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WEB_MODULE = "troapi.wsgi"
+
+# should not be imported by serving JSON from the database
+HEAVY_MODULES = ["matplotlib", "cartopy", "tropycal", "pandas", "xarray", "scipy", "shapely"]
+
+CHILD_SCRIPT = f"""
+import json, resource, sys
+import {WEB_MODULE}
+print(json.dumps({{
+    "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "heavy": sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules),
+}}))
+"""
+
+
+def parse_importtime(stderr):
+    """Self and cumulative import time per module, in microseconds"""
+
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+
+    return timings
+
+
+def run_once():
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD_SCRIPT], cwd=PROJECT_ROOT,
+                             capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+
+    if process.returncode != 0:
+        sys.exit(f"Importing {WEB_MODULE} failed:\n{process.stderr}")
+
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["wall_s"] = elapsed
+    result["imports"] = parse_importtime(process.stderr)
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters to start")
+    parser.add_argument("--top", type=int, default=10, help="slowest modules to list")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.repeat)]
+    best = min(runs, key=lambda run: run["wall_s"])
+
+    print(f"{WEB_MODULE} cold start, best of {args.repeat}")
+    print(f"wall time:   {best['wall_s'] * 1000:.0f} ms")
+    print(f"import time: {best['imports'][WEB_MODULE][1] / 1000:.0f} ms")
+    print(f"peak RSS:    {best['maxrss_kb'] / 1024:.1f} MB")
+    print("slowest modules, by their own import time:")
+    for name, (self_us, _) in sorted(best["imports"].items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+    if best["heavy"]:
+        sys.exit(f"web worker imported {', '.join(best['heavy'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""Recorded realtime data, replayed offline in place of the live JTWC/NHC feeds
+
+A fixture is a pickled dict of the storm dicts tropycal builds RealtimeStorm objects from, the latest forecast of
+every storm, and the time it was recorded. Fixtures are either recorded from the live feeds, or generated as
+synthetic seasons of any size:
+
+    python benchmarks/replay.py record fixtures/realtime.pkl --jtwc-source jtwc
+    python benchmarks/replay.py synthesize fixtures/season.pkl --storms 40
+
+Replaying installs a factory on the realtime snapshot cache, so update_storms and plot_summary consume the fixture
+exactly as they would a live download.
+"""
+
+import argparse
+import math
+import os
+import pickle
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tropycal.realtime import Realtime, RealtimeStorm  # noqa: E402
+
+from troapi.snapshot import snapshots  # noqa: E402
+
+# basin, storm id prefix, genesis region as (lat, lon)
+BASINS = [
+    ("north_atlantic", "AL", (15.0, -45.0)),
+    ("east_pacific", "EP", (12.0, -105.0)),
+    ("west_pacific", "WP", (14.0, 140.0)),
+    ("north_indian", "IO", (14.0, 88.0)),
+    ("south_indian", "SH", (-14.0, 75.0)),
+    ("australia", "SH", (-15.0, 125.0)),
+    ("south_pacific", "SH", (-16.0, 170.0)),
+]
+
+FORECAST_HOURS = [0, 12, 24, 36, 48, 72, 96, 120]
+
+
+class FixtureRealtimeStorm(RealtimeStorm):
+    """RealtimeStorm with a recorded latest forecast"""
+
+    def __init__(self, storm, forecast=None):
+        self.recorded_forecast = forecast
+
+        super(FixtureRealtimeStorm, self).__init__(storm)
+
+    def get_archer(self):
+        # no archer data offline
+        raise RuntimeError("Archer data is not recorded")
+
+    def get_forecast_realtime(self, ssl_certificate=True):
+        if self.recorded_forecast is None:
+            raise RuntimeError("No forecast was recorded for this storm")
+
+        self.latest_forecast = dict(self.recorded_forecast)
+        return self.latest_forecast
+
+
+class FixtureRealtime(Realtime):
+    """Realtime object built from recorded storms instead of the live feeds"""
+
+    def __init__(self, fixture, jtwc_source="jtwc"):
+        self.jtwc = True
+        self.jtwc_source = jtwc_source
+        self.ssl_certificate = False
+
+        for storm_id, storm in fixture["storms"].items():
+            self[storm_id] = FixtureRealtimeStorm(storm, fixture["forecasts"].get(storm_id))
+
+        self.storms = list(fixture["storms"])
+        self.time = fixture["time"]
+
+        self.attrs = {
+            'jtwc': self.jtwc,
+            'jtwc_source': jtwc_source,
+            'time': self.time
+        }
+
+
+def load_fixture(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def save_fixture(fixture, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    with open(path, "wb") as f:
+        pickle.dump(fixture, f)
+
+
+def record_fixture(jtwc_source="jtwc"):
+    """Record the live realtime storms and their forecasts"""
+
+    realtime_obj = Realtime(jtwc=True, jtwc_source=jtwc_source, ssl_certificate=False)
+
+    storms = {}
+    forecasts = {}
+
+    for storm_id in realtime_obj.list_active_storms():
+        realtime_storm = realtime_obj.get_storm(storm_id)
+        storms[storm_id] = realtime_storm.dict
+
+        if realtime_storm.invest:
+            continue
+
+        try:
+            forecasts[storm_id] = realtime_storm.get_forecast_realtime(ssl_certificate=False)
+        except Exception as e:
+            print(f"No forecast recorded for {storm_id}: {e}")
+
+    return {"storms": storms, "forecasts": forecasts, "time": realtime_obj.time}
+
+
+def synthesize_storm(number, basin, prefix, origin, start, points, rng):
+    invest = number >= 90
+    storm_id = f"{prefix}{number:02d}{start.year}"
+
+    lat, lon = origin[0] + rng.uniform(-4, 4), origin[1] + rng.uniform(-10, 10)
+    heading = -1.0 if lat > 0 else 1.0
+
+    storm = {
+        "id": storm_id,
+        "operational_id": storm_id,
+        "name": f"{number:02d}{prefix[0]}" if invest else f"SYNTH{number:02d}",
+        "year": start.year,
+        "season": start.year,
+        "basin": basin,
+        "source_info": "Synthetic",
+        "source_method": "Synthetic",
+        "source_url": "",
+        "source": "jtwc",
+        "jtwc_source": "jtwc",
+        "invest": invest,
+        "realtime": True,
+        "ace": 0.0,
+        "prob_2day": "N/A",
+        "prob_5day": "N/A",
+        "risk_2day": "N/A",
+        "risk_5day": "N/A",
+        "date": [], "extra_obs": [], "special": [], "type": [], "lat": [], "lon": [], "vmax": [], "mslp": [],
+        "wmo_basin": [],
+    }
+
+    vmax = 25.0
+    for i in range(points):
+        # recurving track, intensifying then decaying
+        lat += 0.3 + 0.02 * i * (1 if lat > 0 else -1) * -heading
+        lon += heading * max(0.6 - 0.03 * i, -0.8)
+        vmax = max(20.0, min(150.0, vmax + rng.uniform(-5, 10) - (0.4 * i if i > points / 2 else 0)))
+
+        storm["date"].append(start + timedelta(hours=6 * i))
+        storm["extra_obs"].append(0)
+        storm["special"].append("")
+        storm["type"].append("DB" if invest else ("TS" if vmax < 64 else "TY"))
+        storm["lat"].append(round(lat, 1))
+        storm["lon"].append(round(lon, 1))
+        storm["vmax"].append(vmax if i % 9 else math.nan)
+        storm["mslp"].append(round(1010 - (vmax - 20) * 0.9))
+        storm["wmo_basin"].append(basin)
+        storm["ace"] += 1e-4 * vmax ** 2
+
+    if invest:
+        return storm, None
+
+    forecast = {
+        "init": storm["date"][-1],
+        "fhr": list(FORECAST_HOURS),
+        "lat": [round(lat + 0.4 * fhr / 12, 1) for fhr in FORECAST_HOURS],
+        "lon": [round(lon + heading * 0.5 * fhr / 12, 1) for fhr in FORECAST_HOURS],
+        "vmax": [round(max(20.0, vmax - fhr / 8)) for fhr in FORECAST_HOURS],
+        "mslp": [round(1010 - (max(20.0, vmax - fhr / 8) - 20) * 0.9) for fhr in FORECAST_HOURS],
+        "type": ["TS" if vmax - fhr / 8 < 64 else "HU" for fhr in FORECAST_HOURS],
+        "windrad": [{34: [60, 60, 40, 40]} for _ in FORECAST_HOURS],
+        "cumulative_ace": [round(storm["ace"] + 0.5 * i, 1) for i in range(len(FORECAST_HOURS))],
+        "cumulative_ace_fhr": list(FORECAST_HOURS),
+    }
+
+    return storm, forecast
+
+
+def synthesize_fixture(storms=30, points=40, invests=4, seed=0, time=None):
+    """A synthetic season of active storms spread over every basin"""
+
+    rng = random.Random(seed)
+    time = time or datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+
+    fixture = {"storms": {}, "forecasts": {}, "time": time}
+    numbers = {}
+
+    for i in range(storms + invests):
+        basin, prefix, origin = BASINS[i % len(BASINS)]
+
+        # storms are numbered per prefix, invests from 90 up
+        invest = i >= storms
+        key = (prefix, invest)
+        numbers[key] = numbers.get(key, 90 if invest else 1)
+        number = numbers[key]
+        numbers[key] += 1
+
+        length = rng.randint(max(2, points // 2), points)
+        start = time - timedelta(hours=6 * length)
+
+        storm, forecast = synthesize_storm(number, basin, prefix, origin, start, length, rng)
+        fixture["storms"][storm["id"]] = storm
+
+        if forecast:
+            fixture["forecasts"][storm["id"]] = forecast
+
+    return fixture
+
+
+def advance_fixture(fixture, hours=6):
+    """The fixture one observation later. Every storm gains a track point and a new forecast"""
+
+    time = fixture["time"] + timedelta(hours=hours)
+    advanced = {"storms": {}, "forecasts": {}, "time": time}
+
+    for storm_id, storm in fixture["storms"].items():
+        storm = {key: list(value) if isinstance(value, list) else value for key, value in storm.items()}
+
+        for key in ("extra_obs", "special", "type", "vmax", "mslp", "wmo_basin"):
+            storm[key].append(storm[key][-1])
+
+        storm["date"].append(storm["date"][-1] + timedelta(hours=hours))
+        storm["lat"].append(round(storm["lat"][-1] + 0.3 * (1 if storm["lat"][-1] > 0 else -1), 1))
+        storm["lon"].append(round(storm["lon"][-1] - 0.5, 1))
+        advanced["storms"][storm_id] = storm
+
+        forecast = fixture["forecasts"].get(storm_id)
+        if forecast:
+            advanced["forecasts"][storm_id] = dict(forecast, init=storm["date"][-1])
+
+    return advanced
+
+
+def install(fixture):
+    """Serve a fixture from the realtime snapshot cache, in place of the live feeds"""
+
+    snapshots.factory = lambda jtwc_source: FixtureRealtime(fixture, jtwc_source)
+    snapshots.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record = subparsers.add_parser("record", help="record the live realtime storms")
+    record.add_argument("path")
+    record.add_argument("--jtwc-source", default="jtwc")
+
+    synthesize = subparsers.add_parser("synthesize", help="generate a synthetic season")
+    synthesize.add_argument("path")
+    synthesize.add_argument("--storms", type=int, default=30)
+    synthesize.add_argument("--invests", type=int, default=4)
+    synthesize.add_argument("--points", type=int, default=40, help="maximum track points per storm")
+    synthesize.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        fixture = record_fixture(args.jtwc_source)
+    else:
+        fixture = synthesize_fixture(args.storms, args.points, args.invests, args.seed)
+
+    save_fixture(fixture, args.path)
+
+    print(f"Saved {len(fixture['storms'])} storms, {len(fixture['forecasts'])} forecasts to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Benchmark Storm.serialize against the per point loop it replaced
+
+Run from the project root, in the same environment as the API:
+
+    python benchmarks/serialize_benchmark.py --points 500 --repeat 200
+
+Also reports the payload size and JSON parse time of the track in each track format.
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from numpy import isnan
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from troapi.models import Storm, StormForecast  # noqa: E402
+from troapi.models.storm import BASIN_MAPPING, TRACK_FORMATS  # noqa: E402
+
+
+def make_storm(points, forecast_points):
+    start = datetime(2022, 10, 1)
+
+    storm = Storm(
+        id="WP992022",
+        operational_id="WP992022",
+        name="BENCHMARK",
+        year=2022,
+        season=2022,
+        basin="west_pacific",
+        realtime=True,
+        invest=False,
+        update_time=start + timedelta(hours=6 * points),
+        start_date=start,
+        end_date=start + timedelta(hours=6 * (points - 1)),
+        date=[start + timedelta(hours=6 * i) for i in range(points)],
+        type=["TS" if i % 3 else "TD" for i in range(points)],
+        lat=[10.0 + i * 0.1 for i in range(points)],
+        lon=[130.0 + i * 0.1 for i in range(points)],
+        vmax=[math.nan if i % 10 == 0 else 35 + i % 50 for i in range(points)],
+        mslp=[math.nan if i % 7 == 0 else 1000 - i % 40 for i in range(points)],
+        wmo_basin=["west_pacific" if i % 5 else "north_indian" for i in range(points)],
+    )
+
+    storm.forecast = StormForecast(
+        init=storm.end_date,
+        fhr=[12 * i for i in range(forecast_points)],
+        lat=[20.0 + i * 0.5 for i in range(forecast_points)],
+        lon=[140.0 + i * 0.5 for i in range(forecast_points)],
+        vmax=[math.nan if i == 0 else 60 for i in range(forecast_points)],
+        mslp=[980.0 for _ in range(forecast_points)],
+        type=["TY" for _ in range(forecast_points)],
+    )
+
+    return storm
+
+
+def serialize_track_per_point(storm):
+    """The per point serialization Storm.serialize used before it worked on whole columns"""
+
+    track = []
+    for idx, _ in enumerate(storm.date):
+        mslp = None if isnan(storm.mslp[idx]) else storm.mslp[idx]
+        vmax = None if isnan(storm.vmax[idx]) else storm.vmax[idx]
+
+        track.append({
+            "date": storm.date[idx].isoformat(),
+            "lon": storm.lon[idx],
+            "lat": storm.lat[idx],
+            "wind": vmax,
+            "pressure": mslp,
+            "basin": BASIN_MAPPING[storm.wmo_basin[idx]],
+            "type": storm.type[idx],
+            "forecast": False,
+        })
+
+    forecast = storm.forecast
+    for idx, _ in enumerate(forecast.lat):
+        mslp = None if isnan(forecast.mslp[idx]) else forecast.mslp[idx]
+        vmax = None if isnan(forecast.vmax[idx]) else forecast.vmax[idx]
+
+        track.append({
+            "date": (forecast.init + timedelta(hours=forecast.fhr[idx])).isoformat(),
+            "lat": forecast.lat[idx],
+            "lon": forecast.lon[idx],
+            "wind": vmax,
+            "pressure": mslp,
+            "type": forecast.type[idx],
+            "forecast": True,
+        })
+
+    return track
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=500, help="observed track points")
+    parser.add_argument("--forecast-points", type=int, default=11, help="forecast track points")
+    parser.add_argument("--repeat", type=int, default=200, help="serializations per timing")
+    args = parser.parse_args()
+
+    storm = make_storm(args.points, args.forecast_points)
+
+    if storm.serialize()["track"] != serialize_track_per_point(storm):
+        sys.exit("Column wise and per point serialization differ")
+
+    per_point = min(timeit.repeat(lambda: serialize_track_per_point(storm), number=args.repeat, repeat=5))
+    column_wise = min(timeit.repeat(lambda: storm.serialize()["track"], number=args.repeat, repeat=5))
+
+    print(f"{args.points} track points, {args.forecast_points} forecast points, {args.repeat} serializations")
+    print(f"per point:   {per_point / args.repeat * 1000:.3f} ms/storm")
+    print(f"column wise: {column_wise / args.repeat * 1000:.3f} ms/storm")
+    print(f"speedup:     {per_point / column_wise:.2f}x")
+
+    # payload size and client parse time of each track format
+    print()
+    print(f"{'format':<10} {'bytes':>9} {'parse ms':>9}")
+    for track_format in TRACK_FORMATS:
+        body = json.dumps(storm.serialize(track_format=track_format)["track"], separators=(",", ":"))
+        parse = min(timeit.repeat(lambda: json.loads(body), number=args.repeat, repeat=5))
+        print(f"{track_format:<10} {len(body):>9} {parse / args.repeat * 1000:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
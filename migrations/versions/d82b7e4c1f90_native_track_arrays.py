@@ -0,0 +1,86 @@
+"""native track arrays
+
+Revision ID: d82b7e4c1f90
+Revises: c3f1d2a8b5e4
+Create Date: 2026-10-18 10:04:17.893112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd82b7e4c1f90'
+down_revision = 'c3f1d2a8b5e4'
+branch_labels = None
+depends_on = None
+
+# column name, native type, nullable
+STORM_COLUMNS = [
+    ('date', postgresql.ARRAY(sa.DateTime()), False),
+    ('type', postgresql.ARRAY(sa.String()), False),
+    ('lat', postgresql.ARRAY(sa.Float()), False),
+    ('lon', postgresql.ARRAY(sa.Float()), False),
+    ('vmax', postgresql.ARRAY(sa.Float()), False),
+    ('mslp', postgresql.ARRAY(sa.Float()), False),
+    ('extra_obs', postgresql.ARRAY(sa.Integer()), True),
+    ('special', postgresql.ARRAY(sa.String()), True),
+    ('wmo_basin', postgresql.ARRAY(sa.String()), False),
+]
+
+STORM_FORECAST_COLUMNS = [
+    ('fhr', postgresql.ARRAY(sa.Integer()), False),
+    ('lat', postgresql.ARRAY(sa.Float()), False),
+    ('lon', postgresql.ARRAY(sa.Float()), False),
+    ('vmax', postgresql.ARRAY(sa.Float()), False),
+    ('mslp', postgresql.ARRAY(sa.Float()), False),
+    ('type', postgresql.ARRAY(sa.String()), False),
+    ('windrad', postgresql.JSONB(astext_type=sa.Text()), False),
+    ('cumulative_ace', postgresql.ARRAY(sa.Float()), False),
+    ('cumulative_ace_fhr', postgresql.ARRAY(sa.Integer()), False),
+]
+
+
+def to_native(value):
+    # pickled lists may hold numpy scalars
+    return [v.item() if hasattr(v, 'item') else v for v in value]
+
+
+def convert_columns(table_name, columns, from_type, to_type):
+    """Copy every column into a column of a new type, then swap it in place of the old one"""
+
+    conn = op.get_bind()
+
+    for name, native_type, _ in columns:
+        op.add_column(table_name, sa.Column(f'{name}_new', to_type(native_type), nullable=True))
+
+    old_table = sa.table(table_name, sa.column('id'),
+                         *[sa.column(name, from_type(native_type)) for name, native_type, _ in columns])
+    new_table = sa.table(table_name, sa.column('id'),
+                         *[sa.column(f'{name}_new', to_type(native_type)) for name, native_type, _ in columns])
+
+    # backfill row by row
+    for row in conn.execute(sa.select(old_table)).fetchall():
+        values = {}
+        for name, _, _ in columns:
+            value = row._mapping[name]
+            values[f'{name}_new'] = to_native(value) if value is not None else None
+
+        conn.execute(new_table.update().where(new_table.c.id == row._mapping['id']).values(**values))
+
+    for name, _, nullable in columns:
+        op.drop_column(table_name, name)
+        op.alter_column(table_name, f'{name}_new', new_column_name=name, nullable=nullable)
+
+
+def upgrade():
+    convert_columns('storm', STORM_COLUMNS, lambda native_type: sa.PickleType(), lambda native_type: native_type)
+    convert_columns('storm_forecast', STORM_FORECAST_COLUMNS, lambda native_type: sa.PickleType(),
+                    lambda native_type: native_type)
+
+
+def downgrade():
+    convert_columns('storm_forecast', STORM_FORECAST_COLUMNS, lambda native_type: native_type,
+                    lambda native_type: sa.PickleType())
+    convert_columns('storm', STORM_COLUMNS, lambda native_type: native_type, lambda native_type: sa.PickleType())
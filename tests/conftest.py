@@ -0,0 +1,66 @@
+"""Shared fixtures. The API runs against a temporary SQLite database and upload folder, with realtime data
+replayed from synthetic fixtures (see benchmarks/replay.py) and plot rendering skipped"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORK_DIR = tempfile.mkdtemp(prefix="troapi-tests-")
+
+# configuration is read on import
+os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(WORK_DIR, 'troapi.db')}"
+os.environ["UPLOAD_FOLDER"] = os.path.join(WORK_DIR, "uploads")
+os.environ.setdefault("LOG", "WARNING")
+
+sys.path.insert(0, PROJECT_ROOT)
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "benchmarks"))
+
+import replay  # noqa: E402
+from troapi import app as flask_app, db  # noqa: E402
+from troapi.renderer import PlotResult, on_demand_renderer, renderer  # noqa: E402
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        yield flask_app
+
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture(autouse=True)
+def skip_plots(monkeypatch):
+    # same as the ingestion benchmark's --skip-plots, no plot worker processes are started
+    for plot_renderer in (renderer, on_demand_renderer):
+        monkeypatch.setattr(plot_renderer, "render",
+                            lambda jobs: [PlotResult(job.storm_id, job.plot_type, None, "skipped") for job in jobs])
+
+
+@pytest.fixture
+def replay_storms():
+    """Serve a synthetic season of a number of storms as the realtime data. Returns the fixture"""
+
+    def install(storms, **kwargs):
+        fixture = replay.synthesize_fixture(storms, invests=0, **kwargs)
+        replay.install(fixture)
+
+        return fixture
+
+    return install
@@ -0,0 +1,89 @@
+"""Realtime storm responses are cached at a bounded set of keys, written by ingestion only"""
+
+from troapi.models import CachedResponse
+from troapi.models.storm import TRACK_FORMATS
+from troapi.services import StormService
+from troapi.services.cache_service import CACHED_TRACK_THINNING, REALTIME_STORMS_KEY, parse_thinning
+
+
+def cached_keys():
+    return {key for (key,) in CachedResponse.query.with_entities(CachedResponse.key)
+            .filter(CachedResponse.key.startswith(REALTIME_STORMS_KEY))}
+
+
+def test_parse_thinning_keeps_served_levels():
+    assert parse_thinning("") == [(None, None)]
+    assert parse_thinning("0.25:, 1:24,:12") == [(None, None), (0.25, None), (1.0, 24), (None, 12)]
+
+    # unserved levels are never cached
+    assert parse_thinning("0.3:,:7") == [(None, None)]
+
+
+def test_cycle_caches_every_format_at_cached_levels(app, replay_storms):
+    fixture = replay_storms(4)
+
+    StormService.update_storms()
+
+    # the list and every storm
+    assert len(cached_keys()) == (len(fixture["storms"]) + 1) * len(TRACK_FORMATS) * len(CACHED_TRACK_THINNING)
+
+
+def test_thinned_requests_do_not_write_cache(client, replay_storms):
+    fixture = replay_storms(2)
+    storm_id = next(iter(fixture["storms"]))
+
+    StormService.update_storms()
+    keys = cached_keys()
+
+    for url in ["/api/v1/storms/realtime?simplify=1&step=24", f"/api/v1/storms/realtime/{storm_id}?step=6",
+                "/api/v1/storms/realtime?simplify=0.05&format=packed"]:
+        assert client.get(url).status_code == 200
+
+    assert cached_keys() == keys
+
+
+def listed_plots(client, url):
+    response = client.get(url).json
+    storms = response["data"] if "data" in response else [response]
+
+    return {(storm["id"], plot["url"]) for storm in storms for plot in storm["plots"]}
+
+
+def test_plot_writes_refresh_cached_storms(client, replay_storms):
+    from troapi.services import RetentionService
+    from troapi.services.storm_service import save_storm_plot
+
+    fixture = replay_storms(2)
+    storm_id = next(iter(fixture["storms"]))
+
+    StormService.update_storms()
+
+    storm = StormService.get_storm(storm_id)
+    save_storm_plot(storm, "observed_track", "storm_plots/observed_track.png", storm.update_time, storm.fingerprint)
+
+    for url in ["/api/v1/storms/realtime", "/api/v1/storms/realtime?format=packed",
+                f"/api/v1/storms/realtime/{storm_id}"]:
+        assert (storm_id, "/media/storm_plots/observed_track.png") in listed_plots(client, url)
+
+    RetentionService.collect_plots(max_age_hours=0, orphan_minutes=0)
+    # a newer plot of the same type and storm
+    save_storm_plot(storm, "observed_track", "storm_plots/observed_track_2.png", storm.update_time,
+                    storm.fingerprint)
+    RetentionService.collect_plots(keep=1, max_age_hours=0, orphan_minutes=0)
+
+    plots = listed_plots(client, "/api/v1/storms/realtime")
+    assert (storm_id, "/media/storm_plots/observed_track_2.png") in plots
+    assert (storm_id, "/media/storm_plots/observed_track.png") not in plots
+
+
+def test_replace_many_keeps_concurrent_writes(app):
+    from troapi.services import CacheService
+
+    CacheService.set_many({"storms:realtime:a": {"v": 1}})
+    etag = CacheService.get("storms:realtime:a").etag
+
+    # rewritten by someone else in the meantime
+    CacheService.set_many({"storms:realtime:a": {"v": 2}})
+
+    assert CacheService.replace_many({"storms:realtime:a": ({"v": 3}, etag)}) == 0
+    assert CacheService.get("storms:realtime:a").body == b'{"v":2}'
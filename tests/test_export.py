@@ -0,0 +1,43 @@
+"""Realtime storm exports"""
+
+import json
+
+from troapi.models.storm import STORM_FIELDS
+from troapi.services import StormService
+
+
+def ndjson_lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_ndjson_include_limits_parts(client, replay_storms):
+    replay_storms(3)
+    StormService.update_storms()
+
+    lines = ndjson_lines(client.get("/api/v1/storms/realtime/export?format=ndjson&include=plots"))
+
+    assert len(lines) == 3
+    for storm in lines:
+        assert "track" not in storm
+        assert "plots" in storm
+        assert set(STORM_FIELDS) <= set(storm)
+
+
+def test_ndjson_without_include_exports_full_storms(client, replay_storms):
+    replay_storms(2)
+    StormService.update_storms()
+
+    for storm in ndjson_lines(client.get("/api/v1/storms/realtime/export?format=ndjson")):
+        assert "track" in storm and "plots" in storm
+
+
+def test_include_is_validated(client):
+    assert client.get("/api/v1/storms/realtime/export?format=ndjson&include=bogus").status_code == 400
+    assert client.get("/api/v1/storms/realtime/export?include=plots").status_code == 400
+
+
+def test_streamed_exports_have_no_query_count(client, replay_storms):
+    replay_storms(1)
+    StormService.update_storms()
+
+    assert "X-Query-Count" not in client.get("/api/v1/storms/realtime/export").headers
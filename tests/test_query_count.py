@@ -0,0 +1,39 @@
+"""Queries issued by the storm routes do not grow with the number of storms"""
+
+import pytest
+
+from troapi import db
+from troapi.instrumentation import QUERY_COUNT_HEADER
+from troapi.models import CachedResponse
+from troapi.services import StormService
+
+URLS = [
+    "/api/v1/storms/realtime",
+    "/api/v1/storms?fields=id,name,basin,season&include=track,plots",
+]
+
+
+def query_count(client, url):
+    # cached responses are read in a single query whatever their size, measure the uncached path
+    CachedResponse.query.delete()
+    db.session.commit()
+
+    response = client.get(url)
+    assert response.status_code == 200
+
+    return int(response.headers[QUERY_COUNT_HEADER])
+
+
+@pytest.mark.parametrize("url", URLS)
+def test_query_count_does_not_grow_with_storms(client, replay_storms, url):
+    replay_storms(1)
+    StormService.update_storms()
+    assert len(client.get(url).json["data"]) == 1
+
+    one_storm = query_count(client, url)
+
+    replay_storms(12)
+    StormService.update_storms()
+    assert len(client.get(url).json["data"]) == 12
+
+    assert query_count(client, url) == one_storm
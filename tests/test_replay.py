@@ -0,0 +1,70 @@
+"""Replayed realtime data drives update_storms as a live download would"""
+
+import re
+
+import pytest
+from sqlalchemy import event
+
+import replay
+from troapi import db
+from troapi.models import Storm, StormForecast
+from troapi.services import StormService
+
+STORM_TABLES = ("storm", "storm_forecast", "storm_plot")
+
+WRITE_PATTERN = re.compile(r"^\s*(INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+\"?(\w+)", re.IGNORECASE)
+
+
+@pytest.fixture
+def storm_writes(app):
+    """Tables written by each statement issued while the fixture is active"""
+
+    writes = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        match = WRITE_PATTERN.match(statement)
+
+        if match and match.group(2) in STORM_TABLES:
+            writes.append(match.group(2))
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+
+    yield writes
+
+    event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_replayed_cycle_ingests_storms(app, replay_storms):
+    fixture = replay_storms(5)
+
+    StormService.update_storms()
+
+    assert {storm.id for storm in Storm.query.filter_by(realtime=True)} == set(fixture["storms"])
+    assert StormForecast.query.count() == len(fixture["forecasts"])
+
+
+def test_unchanged_cycle_writes_no_storms(app, replay_storms, storm_writes):
+    fixture = replay_storms(5)
+
+    StormService.update_storms()
+    assert storm_writes
+
+    storm_writes.clear()
+
+    replay.install(fixture)
+    StormService.update_storms()
+
+    assert storm_writes == []
+
+
+def test_advanced_cycle_updates_storms(app, replay_storms, storm_writes):
+    fixture = replay_storms(5)
+
+    StormService.update_storms()
+    storm_writes.clear()
+
+    replay.install(replay.advance_fixture(fixture))
+    StormService.update_storms()
+
+    assert "storm" in storm_writes
+    assert all(len(storm.date) == len(fixture["storms"][storm.id]["date"]) + 1 for storm in Storm.query)
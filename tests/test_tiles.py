@@ -0,0 +1,48 @@
+"""Tiles are versioned by the storm data they draw"""
+
+import replay
+from troapi.services import StormService
+from troapi.services.storm_service import save_storm_plot
+from troapi.services.tile_service import get_data_version
+
+
+def test_version_ignores_changes_tiles_do_not_draw(app, replay_storms):
+    fixture = replay_storms(3)
+    storm_id = next(iter(fixture["storms"]))
+
+    StormService.update_storms()
+    version = get_data_version()
+
+    replay.install(fixture)
+    StormService.update_storms()
+    assert get_data_version() == version
+
+    storm = StormService.get_storm(storm_id)
+    save_storm_plot(storm, "observed_track", "storm_plots/observed_track.png", storm.update_time, storm.fingerprint)
+
+    changed = dict(fixture, storms=dict(fixture["storms"]))
+    changed["storms"][storm_id] = dict(fixture["storms"][storm_id], prob_2day="40%")
+    replay.install(changed)
+    StormService.update_storms()
+
+    assert get_data_version() == version
+
+
+def test_version_moves_with_tracks_and_archived_storms(app, replay_storms):
+    fixture = replay_storms(3)
+
+    StormService.update_storms()
+    version = get_data_version()
+
+    replay.install(replay.advance_fixture(fixture))
+    StormService.update_storms()
+    advanced = get_data_version()
+    assert advanced != version
+
+    # a storm leaves the realtime set
+    storm_id = next(iter(fixture["storms"]))
+    remaining = {key: value for key, value in fixture["storms"].items() if key != storm_id}
+    replay.install(replay.advance_fixture(dict(fixture, storms=remaining)))
+    StormService.update_storms()
+
+    assert get_data_version() != advanced
@@ -7,14 +7,9 @@ from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 from healthcheck import HealthCheck
-from troapi.scheduler import scheduler
-import matplotlib
 
 from troapi.config import SETTINGS
 
-# tell matplotlib to use backend that writes to files on the server side
-matplotlib.use('Agg')
-
 logging.basicConfig(
     level=SETTINGS.get('logging', {}).get('level'),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -54,9 +49,25 @@ if not os.path.isdir(app.config['UPLOAD_FOLDER']):
 # pagination
 app.config['ITEMS_PER_PAGE'] = SETTINGS.get('ITEMS_PER_PAGE', 20)
 
+# storms read per batch when streaming exports
+app.config['STREAM_BATCH_SIZE'] = SETTINGS.get('STREAM_BATCH_SIZE', 10)
+
+# number of storms ingested concurrently on each update
+app.config['STORMS_UPDATE_WORKERS'] = int(SETTINGS.get('STORMS_UPDATE_WORKERS', 4))
+
+# summary plots of basins whose storms did not change are carried over, up to this age
+app.config['SUMMARY_PLOT_MAX_AGE_HOURS'] = SETTINGS.get('SUMMARY_PLOT_MAX_AGE_HOURS', 6)
+
+# report queries issued per request
+app.config['QUERY_COUNT_HEADER'] = SETTINGS.get('QUERY_COUNT_HEADER', True)
+
 # Database
 db = SQLAlchemy(app)
 
+from troapi import instrumentation
+
+instrumentation.init_app(app)
+
 migrate = Migrate(app, db)
 
 # wrap flask app and give a healthcheck url
@@ -106,12 +117,5 @@ from troapi import commands
 
 app.cli.add_command(commands.update_storms)
 app.cli.add_command(commands.plot_summary)
-
-from troapi import tasks
-
-scheduler.start()
-#
-# scheduler = BackgroundScheduler()
-# # in your case you could change seconds to hours
-# scheduler.add_job(commands.update_storms, trigger='interval', seconds=3)
-# scheduler.start()
+app.cli.add_command(commands.collect_plots)
+app.cli.add_command(commands.run_worker)
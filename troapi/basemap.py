@@ -0,0 +1,145 @@
+"""Plot BASEMAP
+
+tropycal draws the Natural Earth ocean, lakes, land, states, borders and coastlines from scratch for every plot.
+For a given projection, extent and size that map layer is the same every time, so a plot worker renders it once
+into a raster, and later plots of the same map only paste the raster below their storm layers.
+
+Only imported inside plot worker processes, it pulls in matplotlib, Cartopy and tropycal.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+import cartopy.feature as cfeature
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.image import BboxImage
+from tropycal.tracks.plot import TrackPlot
+
+from troapi.config import SETTINGS
+
+# basemaps kept per worker process. A 9x6 inch map at 200 dpi is about 8 MB
+PLOT_BASEMAP_CACHE_SIZE = int(SETTINGS.get("PLOT_BASEMAP_CACHE_SIZE", 16))
+
+# map properties the map layer is drawn from
+GEOGRAPHY_PROPS = ("res", "ocean_color", "land_color", "linewidth", "linecolor", "state_alpha")
+
+
+class BasemapCache(object):
+    """Rendered basemaps by map, the least recently used dropped first"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._basemaps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        with self._lock:
+            basemap = self._basemaps.get(key)
+
+            if basemap is not None:
+                self._basemaps.move_to_end(key)
+                self.hits += 1
+                return basemap
+
+        basemap = factory()
+
+        with self._lock:
+            self.misses += 1
+            self._basemaps[key] = basemap
+
+            while len(self._basemaps) > self.max_size:
+                self._basemaps.popitem(last=False)
+
+        return basemap
+
+
+basemaps = BasemapCache(PLOT_BASEMAP_CACHE_SIZE)
+
+
+def draw_geography(ax, prop, res):
+    """The map layer, drawn the way tropycal's create_geography does"""
+
+    ax.add_feature(cfeature.OCEAN.with_scale(res), facecolor=prop['ocean_color'], edgecolor='face')
+    ax.add_feature(cfeature.LAKES.with_scale(res), facecolor=prop['ocean_color'], edgecolor='face')
+    ax.add_feature(cfeature.LAND.with_scale(res), facecolor=prop['land_color'], edgecolor='face')
+
+    ax.add_feature(cfeature.STATES.with_scale(res), linewidths=prop['linewidth'], linestyle='solid',
+                   edgecolor=prop['linecolor'], alpha=prop['state_alpha'])
+    ax.add_feature(cfeature.BORDERS.with_scale(res), linewidths=prop['linewidth'], linestyle='solid',
+                   edgecolor=prop['linecolor'])
+    ax.add_feature(cfeature.COASTLINE.with_scale(res), linewidths=prop['linewidth'], linestyle='solid',
+                   edgecolor=prop['linecolor'])
+
+
+def render_basemap(projection, extent, width, height, dpi, prop, res):
+    """RGBA raster of the map layer of a width by height pixel map of extent, in projection coordinates"""
+
+    logging.info(f"[RENDERER]: Rendering {width}x{height} basemap of {extent}")
+
+    # the ocean color shows where the axes background would
+    fig = Figure(figsize=(width / dpi, height / dpi), dpi=dpi, facecolor=prop['ocean_color'])
+    canvas = FigureCanvasAgg(fig)
+
+    ax = fig.add_axes([0, 0, 1, 1], projection=projection)
+    ax.set_extent(extent, crs=projection)
+    ax.set_axis_off()
+
+    draw_geography(ax, prop, res)
+
+    canvas.draw()
+
+    return np.asarray(canvas.buffer_rgba()).copy()
+
+
+class BasemapImage(BboxImage):
+    """Map layer of a GeoAxes, pasted from the basemap cache over the whole axes when drawn"""
+
+    def __init__(self, ax, prop, res):
+        # below every storm layer
+        super(BasemapImage, self).__init__(ax.bbox, interpolation="nearest", zorder=-1)
+
+        self.geo_axes = ax
+        self.prop = prop
+        self.res = res
+
+    def draw(self, renderer):
+        ax = self.geo_axes
+
+        # the map is only known now, tropycal sets the extent after adding the geography
+        width, height = int(round(ax.bbox.width)), int(round(ax.bbox.height))
+        if width < 1 or height < 1:
+            return
+
+        dpi = self.figure.dpi
+        extent = tuple(round(value, 6) for value in ax.get_extent(crs=ax.projection))
+
+        key = (ax.projection.proj4_init, extent, width, height, dpi, self.res,
+               tuple((name, str(self.prop.get(name))) for name in GEOGRAPHY_PROPS))
+
+        self.set_data(basemaps.get(key, lambda: render_basemap(ax.projection, extent, width, height, dpi, self.prop,
+                                                               self.res)))
+
+        super(BasemapImage, self).draw(renderer)
+
+
+class BasemapTrackPlot(TrackPlot):
+    """tropycal TrackPlot drawing its map layer from the basemap cache. Set as the plot_obj of a storm or realtime
+    object, which tropycal then uses for all of its plots"""
+
+    def create_geography(self, prop):
+        res = self.check_res(prop['res'])
+
+        if 'state_alpha' not in prop:
+            prop['state_alpha'] = 1.0
+
+        self.ax.set_facecolor(prop['ocean_color'])
+
+        basemap = BasemapImage(self.ax, dict(prop), res)
+        basemap.set_clip_path(self.ax.patch)
+
+        self.ax.add_artist(basemap)
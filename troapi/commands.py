@@ -3,20 +3,71 @@ import logging
 import click
 from flask.cli import with_appcontext
 
-from troapi.services import StormService
+from troapi.helpers import advisory_lock
+from troapi.services import StormService, RetentionService
 
 
 @click.command(name="update_storms")
 @click.argument('jtwc_source', type=click.STRING, default="jtwc")
-def update_storms(jtwc_source):
+@click.option('--plot-summary', is_flag=True, help="Also plot summaries, from the same realtime download")
+def update_storms(jtwc_source, plot_summary):
     logging.info("[STORMS]: Running Update storms command")
 
-    StormService.update_storms()
+    with advisory_lock("update_storms") as acquired:
+        if not acquired:
+            logging.info("[STORMS]: Storms update already running elsewhere, skipping")
+            return
+
+        StormService.update_storms(jtwc_source)
+
+        # under the same lock as the worker's summaries
+        if plot_summary:
+            logging.info("[STORMS]: Plotting Summaries")
+
+            StormService.plot_summary(jtwc_source)
 
 
 @click.command(name="plot_summary")
+@click.argument('jtwc_source', type=click.STRING, default="jtwc")
 @with_appcontext
-def plot_summary():
+def plot_summary(jtwc_source):
     logging.info("[STORMS]: Plotting Summaries")
 
-    StormService.plot_summary()
+    # summaries are also plotted by the worker after each storms update
+    with advisory_lock("update_storms") as acquired:
+        if not acquired:
+            logging.info("[STORMS]: Storms update already running elsewhere, skipping")
+            return
+
+        StormService.plot_summary(jtwc_source)
+
+
+@click.command(name="collect_plots")
+@click.option('--keep', type=click.INT, help="Plots kept per storm and plot type, and summaries")
+@click.option('--max-age-hours', type=click.FLOAT, help="Age past which plots are removed, 0 keeps them")
+@click.option('--max-bytes', type=click.INT, help="Total size plot files are kept under, 0 for no limit")
+@with_appcontext
+def collect_plots(keep, max_age_hours, max_bytes):
+    logging.info("[PLOTS]: Collecting plots")
+
+    policy = {"keep": keep, "max_age_hours": max_age_hours, "max_bytes": max_bytes}
+
+    with advisory_lock("collect_plots") as acquired:
+        if not acquired:
+            logging.info("[PLOTS]: Plot retention already running elsewhere, skipping")
+            return
+
+        report = RetentionService.collect_plots(**{key: value for key, value in policy.items() if value is not None})
+
+    click.echo(f"Removed {report.storm_plots} storm plots, {report.summary_plots} summary plots and "
+               f"{report.files + report.orphans} files ({report.orphans} orphaned), reclaimed {report.bytes} bytes")
+
+
+@click.command(name="run_worker")
+@with_appcontext
+def run_worker():
+    logging.info("[WORKER]: Running ingestion worker")
+
+    from troapi import worker
+
+    worker.run()
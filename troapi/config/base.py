@@ -12,6 +12,24 @@ SETTINGS = {
     },
     'SQLALCHEMY_DATABASE_URI': os.getenv('SQLALCHEMY_DATABASE_URI'),
     'STORMS_MINUTES_UPDATE_INTERVAL': os.getenv('STORMS_MINUTES_UPDATE_INTERVAL', 5),
+    'STORMS_UPDATE_WORKERS': os.getenv('STORMS_UPDATE_WORKERS', 4),
+    'SUMMARY_PLOT_MAX_AGE_HOURS': os.getenv('SUMMARY_PLOT_MAX_AGE_HOURS', 6),
+    'PLOT_RENDER_WORKERS': os.getenv('PLOT_RENDER_WORKERS', 2),
+    'PLOT_ON_DEMAND_RENDER_WORKERS': os.getenv('PLOT_ON_DEMAND_RENDER_WORKERS', 1),
+    'FORECAST_FETCH_WORKERS': os.getenv('FORECAST_FETCH_WORKERS', 8),
+    'FORECAST_FETCH_TIMEOUT': os.getenv('FORECAST_FETCH_TIMEOUT', 60),
+    'FORECAST_FETCH_RETRIES': os.getenv('FORECAST_FETCH_RETRIES', 2),
+    'PLOT_BASEMAP_CACHE_SIZE': os.getenv('PLOT_BASEMAP_CACHE_SIZE', 16),
+    'PLOT_WEBP_QUALITY': os.getenv('PLOT_WEBP_QUALITY', 80),
+    'PLOT_THUMBNAIL_WIDTHS': os.getenv('PLOT_THUMBNAIL_WIDTHS', '320,640,1024'),
+    'PLOT_RETENTION_KEEP': os.getenv('PLOT_RETENTION_KEEP', 3),
+    'PLOT_RETENTION_MAX_AGE_HOURS': os.getenv('PLOT_RETENTION_MAX_AGE_HOURS', 72),
+    'PLOT_RETENTION_MAX_BYTES': os.getenv('PLOT_RETENTION_MAX_BYTES', 0),
+    'PLOT_RETENTION_ORPHAN_MINUTES': os.getenv('PLOT_RETENTION_ORPHAN_MINUTES', 60),
+    'PLOT_RETENTION_BATCH_SIZE': os.getenv('PLOT_RETENTION_BATCH_SIZE', 500),
+    'PLOT_RETENTION_MINUTES_INTERVAL': os.getenv('PLOT_RETENTION_MINUTES_INTERVAL', 60),
+    'CACHED_TRACK_THINNING': os.getenv('CACHED_TRACK_THINNING', ''),
+    'QUERY_COUNT_HEADER': os.getenv('QUERY_COUNT_HEADER', 'True') == 'True',
     "UPLOAD_FOLDER": os.getenv('UPLOAD_FOLDER', os.path.join(os.getcwd(), 'uploads')),
     "MEDIA_URL": os.getenv('MEDIA_URL', "/media/")
 }
@@ -19,3 +19,11 @@ class StormNotFound(Error):
 
 class StormHasNoForecast(Error):
     pass
+
+
+class StormPlotError(Error):
+    pass
+
+
+class TilesUnavailable(Error):
+    pass
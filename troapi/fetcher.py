@@ -0,0 +1,79 @@
+"""Forecast FETCHER
+
+Downloads the official forecast of every active storm concurrently, once per ingestion cycle, so the same
+forecast is used for the StormForecast upsert and the forecast plot instead of being fetched for each.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from troapi.config import SETTINGS
+
+
+def fetch_forecast(realtime_storm, retries, backoff):
+    """Fetch the latest forecast of a storm, retrying failed attempts"""
+
+    for attempt in range(1, retries + 2):
+        try:
+            return realtime_storm.get_forecast_realtime(ssl_certificate=False)
+        except Exception as e:
+            if attempt > retries:
+                raise
+
+            logging.warning(f"[FETCHER]: Attempt {attempt} to fetch forecast for storm {realtime_storm.id} "
+                            f"failed, {e}")
+
+            time.sleep(backoff * attempt)
+
+
+class ForecastFetcher(object):
+    """Thread pool backed forecast fetcher"""
+
+    def __init__(self, max_workers=None, timeout=None, retries=0, backoff=1):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+    def fetch(self, realtime_storms):
+        """Fetch the forecasts of storms concurrently. Returns forecasts by storm id, None for storms whose forecast
+        could not be fetched within the timeout"""
+
+        forecasts = {realtime_storm.id: None for realtime_storm in realtime_storms}
+
+        if not realtime_storms:
+            return forecasts
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="forecast-fetch")
+
+        try:
+            futures = {executor.submit(fetch_forecast, realtime_storm, self.retries, self.backoff): realtime_storm.id
+                       for realtime_storm in realtime_storms}
+
+            # one deadline for the whole batch, a slow upstream can't hold the ingestion cycle
+            done, not_done = wait(futures, timeout=self.timeout)
+
+            for future in done:
+                storm_id = futures[future]
+
+                try:
+                    forecasts[storm_id] = future.result()
+                except Exception as e:
+                    logging.error(f"[FETCHER]: Error fetching forecast for storm {storm_id}, {e}")
+
+            for future in not_done:
+                logging.error(f"[FETCHER]: Timed out fetching forecast for storm {futures[future]}")
+        finally:
+            # don't wait for fetches that timed out
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        logging.info(f"[FETCHER]: Fetched {sum(f is not None for f in forecasts.values())} of "
+                     f"{len(forecasts)} forecasts")
+
+        return forecasts
+
+
+fetcher = ForecastFetcher(max_workers=int(SETTINGS.get("FORECAST_FETCH_WORKERS", 8)),
+                          timeout=float(SETTINGS.get("FORECAST_FETCH_TIMEOUT", 60)),
+                          retries=int(SETTINGS.get("FORECAST_FETCH_RETRIES", 2)))
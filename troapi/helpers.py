@@ -1,7 +1,15 @@
+import fcntl
+import os
+import tempfile
+import zlib
 from contextlib import contextmanager
 
+from sqlalchemy import text
+
 from troapi import db
 
+LOCK_FOLDER = os.path.join(tempfile.gettempdir(), "troapi-locks")
+
 
 @contextmanager
 def transaction():
@@ -11,3 +19,42 @@ def transaction():
     except Exception:
         db.session.rollback()
         raise
+
+
+@contextmanager
+def file_lock(name):
+    """Exclusive lock shared by every thread and process on this host, held for the duration of the block"""
+
+    os.makedirs(LOCK_FOLDER, exist_ok=True)
+
+    with open(os.path.join(LOCK_FOLDER, f"{name}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def advisory_lock(name):
+    """Cluster wide lock held in postgres for the duration of the block. Yields whether it was acquired.
+
+    The lock does not wait, and is released by postgres if the holding process dies. On databases without
+    advisory locks it is always acquired.
+    """
+
+    if db.engine.dialect.name != "postgresql":
+        yield True
+        return
+
+    key = zlib.crc32(name.encode("utf-8"))
+
+    # advisory locks belong to the connection that took them, keep a dedicated one for the whole block
+    with db.engine.connect() as connection:
+        acquired = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key}).scalar()
+
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
@@ -0,0 +1,82 @@
+"""Query count instrumentation
+
+Counts the SQL statements issued while a request is handled, or inside a count_queries() block, and reports
+them in the logs and the X-Query-Count response header. Streamed responses are not reported, their queries are
+issued while the body is sent.
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+QUERY_COUNT_HEADER = "X-Query-Count"
+
+_local = threading.local()
+
+
+class QueryCounter(object):
+
+    def __init__(self):
+        self.count = 0
+
+
+def get_active_counters():
+    # counters are per thread, like the scoped sessions that issue the queries
+    if not hasattr(_local, "counters"):
+        _local.counters = []
+    return _local.counters
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    for counter in get_active_counters():
+        counter.count += 1
+
+
+@contextmanager
+def count_queries():
+    """Count the queries issued by the current thread inside the block"""
+
+    counter = QueryCounter()
+    counters = get_active_counters()
+    counters.append(counter)
+
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def init_app(app):
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+
+    @app.before_request
+    def start_counting_queries():
+        g.query_counter = QueryCounter()
+        get_active_counters().append(g.query_counter)
+
+    @app.after_request
+    def report_query_count(response):
+        counter = g.get("query_counter")
+
+        # streamed bodies are generated after this, and files sent from disk issue no queries while read
+        if response.is_streamed and not response.direct_passthrough:
+            return response
+
+        if counter:
+            logging.info(f"[DB]: {counter.count} queries for {request.method} {request.path}")
+
+            if app.config['QUERY_COUNT_HEADER']:
+                response.headers[QUERY_COUNT_HEADER] = str(counter.count)
+
+        return response
+
+    @app.teardown_request
+    def stop_counting_queries(exc):
+        counter = g.pop("query_counter", None)
+
+        if counter in get_active_counters():
+            get_active_counters().remove(counter)
@@ -1,2 +1,3 @@
 from troapi.models.storm import Storm, StormForecast, StormPlot
 from troapi.models.plot import Plot, PlotFile
+from troapi.models.cache import CachedResponse
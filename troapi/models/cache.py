@@ -0,0 +1,22 @@
+from sqlalchemy.orm import deferred
+
+from troapi import db
+
+
+class CachedResponse(db.Model):
+    __tablename__ = "cached_response"
+
+    key = db.Column(db.String(255), primary_key=True)
+    # only loaded when the body is actually sent, conditional requests only need the validators
+    body = deferred(db.Column(db.LargeBinary, nullable=False))
+    etag = db.Column(db.String(64), nullable=False)
+    updated_on = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, key, body, etag, updated_on):
+        self.key = key
+        self.body = body
+        self.etag = etag
+        self.updated_on = updated_on
+
+    def __repr__(self):
+        return '<CachedResponse %r>' % self.key
@@ -1,3 +1,6 @@
+from sqlalchemy import PickleType
+from sqlalchemy.dialects.postgresql import JSONB
+
 from troapi import db
 
 from troapi.config import SETTINGS
@@ -5,6 +8,21 @@ from troapi.config import SETTINGS
 MEDIA_URL = SETTINGS.get("MEDIA_URL")
 
 
+def serialize_variants(variants):
+    """Variants of a plot with their urls, smallest first. Plots rendered before variants existed have none"""
+
+    return [
+        {
+            "format": variant["format"],
+            "width": variant["width"],
+            "height": variant["height"],
+            "bytes": variant["bytes"],
+            "url": MEDIA_URL + variant["file_path"],
+        }
+        for variant in sorted(variants or [], key=lambda variant: variant["bytes"])
+    ]
+
+
 class Plot(db.Model):
     __tablename__ = "plot"
 
@@ -19,7 +37,7 @@ class Plot(db.Model):
     def serialize(self):
         return {
             "id": self.id,
-            "plots": self.files,
+            "plots": [plot_file.serialize() for plot_file in self.files],
             "created_on": self.created_on,
         }
 
@@ -31,13 +49,22 @@ class PlotFile(db.Model):
     plot_id = db.Column(db.String, db.ForeignKey('plot.id'), nullable=False)
     basin = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String, nullable=False)
+    # optimized images of the plot, see optimizer.optimize_plot
+    variants = db.Column(JSONB().with_variant(PickleType(), "sqlite"), nullable=True)
+    # hash of the storms the basin shows, and when the file was rendered. Files of unchanged basins are carried
+    # over to the next summary plot
+    fingerprint = db.Column(db.String(64), nullable=True)
+    updated_on = db.Column(db.DateTime, nullable=True)
 
     plot = db.relationship("Plot", back_populates="files")
 
-    def __init__(self, plot_id, basin, file_path):
+    def __init__(self, plot_id, basin, file_path, variants=None, fingerprint=None, updated_on=None):
         self.plot_id = plot_id
         self.basin = basin
         self.file_path = file_path
+        self.variants = variants
+        self.fingerprint = fingerprint
+        self.updated_on = updated_on
 
     def __repr__(self):
         return '<PlotFile %r>' % self.id
@@ -45,5 +72,7 @@ class PlotFile(db.Model):
     def serialize(self):
         return {
             "basin": self.basin,
-            "url": MEDIA_URL + self.file_path
+            "updated_on": self.updated_on.isoformat() if self.updated_on else None,
+            "url": MEDIA_URL + self.file_path,
+            "variants": serialize_variants(self.variants)
         }
@@ -1,13 +1,17 @@
-from datetime import timedelta
+import base64
+import hashlib
+from datetime import datetime
 
-from numpy import isnan
+import numpy as np
 from sqlalchemy import PickleType
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.ext.mutable import MutableList
 from sqlalchemy.orm import backref
 
 from troapi.config import SETTINGS
 
 from troapi import db
+from troapi.models.plot import serialize_variants
 
 BASIN_MAPPING = {
     "north_atlantic": "NA",
@@ -24,9 +28,210 @@ BASIN_MAPPING = {
 
 MEDIA_URL = SETTINGS.get("MEDIA_URL")
 
+# track representations. json is a list of point objects, columnar is parallel arrays, packed is columnar with
+# the numeric arrays as base64 little endian typed array buffers
+TRACK_FORMATS = ("json", "columnar", "packed")
+
+# track thinning levels served. Simplification tolerances in degrees, downsampling steps in hours. Realtime storm
+# responses are only cached at some of them, see cache_service.CACHED_TRACK_THINNING
+SIMPLIFY_LEVELS = (0.05, 0.25, 1)
+STEP_LEVELS = (6, 12, 24)
+
+# scalar fields of a serialized storm, and the parts that can be included with them
+STORM_FIELDS = ('id', 'operational_id', 'update_time', 'start_date', 'end_date', 'name', 'year', 'season', 'basin',
+                'source_info', 'invest', 'source_method', 'source_url', 'source', 'ace', 'prob_2day', 'prob_5day',
+                'risk_2day', 'risk_5day', 'realtime')
+STORM_PARTS = ('track', 'plots')
+
+# columns a serialized track is built from, besides the forecast
+TRACK_COLUMNS = ('date', 'type', 'lat', 'lon', 'vmax', 'mslp', 'wmo_basin')
+
+# typed array of each packed column
+PACKED_DTYPES = {
+    "date": "<u4",
+    "lat": "<f4",
+    "lon": "<f4",
+    "wind": "<f4",
+    "pressure": "<f4",
+    "type": "<u1",
+    "basin": "<u1",
+}
+
+
+def nan_to_none(values):
+    """List of track values, with NaN values replaced by None. Non NaN values are kept as they are"""
+    values = np.array(values, dtype=object)
+
+    if len(values):
+        values[np.isnan(values.astype(float))] = None
+
+    return values.tolist()
+
+
+def isoformat_dates(dates):
+    """Format a datetime64 array the same way datetime.isoformat does for whole seconds"""
+    return np.datetime_as_string(np.asarray(dates, dtype="datetime64[s]"), unit="s").tolist()
+
+
+def map_basins(wmo_basins):
+    """Map wmo basin names to their codes, looking up each distinct basin once"""
+    if not len(wmo_basins):
+        return []
+
+    names, inverse = np.unique(np.asarray(wmo_basins), return_inverse=True)
+    codes = np.array([BASIN_MAPPING[name] for name in names])
+
+    return codes[inverse].tolist()
+
+
+def epoch_seconds(dates):
+    """Seconds since the epoch of each date"""
+    return np.asarray(dates, dtype="datetime64[s]").astype(np.int64).tolist()
+
+
+def dictionary_encode(values):
+    """Distinct values, and the index of each value in them"""
+    if not len(values):
+        return [], []
+
+    dictionary, codes = np.unique(np.asarray(values), return_inverse=True)
+
+    return dictionary.tolist(), codes.tolist()
+
+
+def pack_column(values, dtype):
+    """Base64 of a column as a typed array. Missing values are packed as NaN"""
+    values = np.array(values, dtype=object)
+
+    if len(values):
+        values[values == None] = np.nan  # noqa: E711
+
+    return base64.b64encode(values.astype(dtype).tobytes()).decode("ascii")
+
+
+def get_fingerprint(date, lat, lon, vmax, mslp, forecast_init=None):
+    """Hash of a storm track and forecast init time. Values are normalized, so incoming data and the same data
+    read back from the database hash the same"""
+
+    fingerprint = hashlib.sha256()
+
+    fingerprint.update(repr([d.isoformat() for d in date]).encode())
+
+    for values in (lat, lon, vmax, mslp):
+        fingerprint.update(repr([float(v) for v in values]).encode())
+
+    if forecast_init:
+        fingerprint.update(forecast_init.isoformat().encode())
+
+    return fingerprint.hexdigest()
+
+
+def track_extent(lat, lon, vmax, mslp):
+    """Peak intensity and bounding box of a track, stored with the storm so archive queries can filter on them"""
+
+    def reduce(func, values):
+        values = np.asarray(values, dtype=float)
+
+        if not len(values) or np.isnan(values).all():
+            return None
+
+        return float(func(values))
+
+    return {
+        "max_wind": reduce(np.nanmax, vmax),
+        "min_pressure": reduce(np.nanmin, mslp),
+        "min_lat": reduce(np.nanmin, lat),
+        "max_lat": reduce(np.nanmax, lat),
+        "min_lon": reduce(np.nanmin, lon),
+        "max_lon": reduce(np.nanmax, lon),
+    }
+
+
+def downsample_index(dates, step):
+    """Index of the first track point in each step hour window, and of the last point"""
+    seconds = np.asarray(dates, dtype="datetime64[s]").astype(np.int64)
+
+    if len(seconds) < 3:
+        return np.arange(len(seconds))
+
+    _, index = np.unique((seconds - seconds[0]) // int(step * 3600), return_index=True)
+
+    return np.union1d(index, [len(seconds) - 1])
+
+
+def simplify_index(lat, lon, tolerance):
+    """Index of the track points kept by Douglas-Peucker simplification, with tolerance in degrees. Longitudes are
+    unwrapped across the antimeridian and scaled by the cosine of the latitude, so the tolerance is about the same
+    distance everywhere. Points without a position are kept"""
+    lat = np.asarray(lat, dtype=float)
+    lon = np.degrees(np.unwrap(np.radians(np.asarray(lon, dtype=float))))
+
+    if len(lat) < 3:
+        return np.arange(len(lat))
+
+    x = lon * np.cos(np.radians(np.nanmean(lat)))
+    y = lat
+
+    keep = np.zeros(len(lat), dtype=bool)
+    keep[[0, -1]] = True
+
+    # segments still to simplify, as (start, end) index pairs
+    stack = [(0, len(lat) - 1)]
+
+    while stack:
+        start, end = stack.pop()
+
+        if end - start < 2:
+            continue
+
+        # distance of every point between start and end from the segment joining them
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length = np.hypot(dx, dy)
+
+        if length:
+            distances = np.abs(dx * py - dy * px) / length
+        else:
+            distances = np.hypot(px, py)
+
+        distances = np.where(np.isnan(distances), np.inf, distances)
+
+        farthest = int(np.argmax(distances))
+
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return np.flatnonzero(keep)
+
+
+def take(values, index):
+    """Values of a track column at index, None for the whole column"""
+    if index is None:
+        return list(values)
+
+    return [values[i] for i in index.tolist()]
+
+
+def track_array(item_type):
+    """Native postgres array column for track values. Falls back to a pickled list on SQLite"""
+    return MutableList.as_mutable(ARRAY(item_type).with_variant(PickleType(), "sqlite"))
+
+
+def track_json():
+    """JSONB column for nested track values. Falls back to a pickled list on SQLite"""
+    return MutableList.as_mutable(JSONB().with_variant(PickleType(), "sqlite"))
+
 
 class Storm(db.Model):
     __tablename__ = "storm"
+    __table_args__ = (
+        db.Index("ix_storm_basin_season", "basin", "season"),
+        db.Index("ix_storm_start_date_end_date", "start_date", "end_date"),
+        db.Index("ix_storm_update_time_id", "update_time", "id"),
+    )
 
     id = db.Column(db.String(255), primary_key=True)
     operational_id = db.Column(db.String(255), nullable=True)
@@ -49,15 +254,22 @@ class Storm(db.Model):
     realtime = db.Column(db.Boolean, default=False, nullable=False)
     invest = db.Column(db.Boolean, default=False, nullable=False)
     update_time = db.Column(db.DateTime, nullable=False)
-    date = db.Column(MutableList.as_mutable(PickleType), nullable=False)
-    type = db.Column(MutableList.as_mutable(PickleType), nullable=False)
-    lat = db.Column(MutableList.as_mutable(PickleType), nullable=False)
-    lon = db.Column(MutableList.as_mutable(PickleType), nullable=False)
-    vmax = db.Column(MutableList.as_mutable(PickleType), nullable=False)
-    mslp = db.Column(MutableList.as_mutable(PickleType), nullable=False)
-    extra_obs = db.Column(MutableList.as_mutable(PickleType), nullable=True)
-    special = db.Column(MutableList.as_mutable(PickleType), nullable=True)
-    wmo_basin = db.Column(MutableList.as_mutable(PickleType), nullable=False)
+    date = db.Column(track_array(db.DateTime), nullable=False)
+    type = db.Column(track_array(db.String), nullable=False)
+    lat = db.Column(track_array(db.Float), nullable=False)
+    lon = db.Column(track_array(db.Float), nullable=False)
+    vmax = db.Column(track_array(db.Float), nullable=False)
+    mslp = db.Column(track_array(db.Float), nullable=False)
+    extra_obs = db.Column(track_array(db.Integer), nullable=True)
+    special = db.Column(track_array(db.String), nullable=True)
+    wmo_basin = db.Column(track_array(db.String), nullable=False)
+    # track extent, see track_extent. The PostGIS track geography is maintained by a trigger on lat and lon
+    max_wind = db.Column(db.Float, nullable=True, index=True)
+    min_pressure = db.Column(db.Float, nullable=True, index=True)
+    min_lat = db.Column(db.Float, nullable=True)
+    max_lat = db.Column(db.Float, nullable=True)
+    min_lon = db.Column(db.Float, nullable=True)
+    max_lon = db.Column(db.Float, nullable=True)
     forecast = db.relationship("StormForecast", back_populates="storm", uselist=False)
     plot = db.relationship("StormPlot", back_populates="storm", order_by="desc(StormPlot.updated_on)")
 
@@ -69,62 +281,161 @@ class Storm(db.Model):
     def __repr__(self):
         return '<Storm %r>' % self.id
 
-    def serialize(self, include=None):
-        """Return object data in easily serializable format"""
+    def serialize(self, include=None, track_format="json", fields=None, simplify=None, step=None):
+        """Return object data in easily serializable format. With fields, only those fields and the parts in include
+        are serialized, and only their columns need to be loaded. Without fields every field is, with the parts in
+        include, all of them when include is None. simplify and step thin the observed track, see track_index"""
+
+        if fields is None:
+            fields = STORM_FIELDS
+            include = STORM_PARTS if include is None else include
 
         include = include if include else []
 
-        track = []
-        for idx, _ in enumerate(self.date):
-            mslp = None if isnan(self.mslp[idx]) else self.mslp[idx]
-            vmax = None if isnan(self.vmax[idx]) else self.vmax[idx]
-
-            feature = {
-                "date": self.date[idx].isoformat(),
-                "lon": self.lon[idx],
-                "lat": self.lat[idx],
-                "wind": vmax,
-                "pressure": mslp,
-                "basin": BASIN_MAPPING[self.wmo_basin[idx]],
-                "type": self.type[idx],
+        storm = {}
+
+        for field in fields:
+            value = getattr(self, field)
+            storm[field] = value.isoformat() if isinstance(value, datetime) else value
+
+        if "track" in include:
+            index = self.track_index(simplify, step)
+
+            if track_format == "json":
+                storm["track"] = self.serialize_track(index)
+            else:
+                storm["track"] = self.serialize_columnar_track(packed=track_format == "packed", index=index)
+
+        if "plots" in include:
+            storm["plots"] = []
+
+            for plot in self.plot:
+                storm["plots"].append(plot.serialize())
+
+        return storm
+
+    def track_index(self, simplify=None, step=None):
+        """Index of the observed track points kept when downsampling to one point every step hours, then simplifying
+        with a tolerance of simplify degrees. None keeps every point"""
+
+        if not simplify and not step:
+            return None
+
+        index = np.arange(len(self.date))
+
+        if step:
+            index = downsample_index(self.date, step)
+
+        if simplify:
+            index = index[simplify_index(take(self.lat, index), take(self.lon, index), simplify)]
+
+        return index
+
+    def serialize_track(self, index=None):
+        """Observed and forecast track points. index selects observed points, see track_index"""
+
+        # convert whole columns at once, then assemble the track points from them
+        dates = isoformat_dates(take(self.date, index))
+        vmax = nan_to_none(take(self.vmax, index))
+        mslp = nan_to_none(take(self.mslp, index))
+        basins = map_basins(take(self.wmo_basin, index))
+        lon, lat, types = take(self.lon, index), take(self.lat, index), take(self.type, index)
+
+        track = [
+            {
+                "date": date,
+                "lon": lon,
+                "lat": lat,
+                "wind": wind,
+                "pressure": pressure,
+                "basin": basin,
+                "type": storm_type,
                 "forecast": False,
             }
+            for date, lon, lat, wind, pressure, basin, storm_type in
+            zip(dates, lon, lat, vmax, mslp, basins, types)
+        ]
 
-            track.append(feature)
+        if self.forecast:
+            track = track + self.forecast.serialize()
 
-        storm = {
-            'id': self.id,
-            'operational_id': self.operational_id,
-            'update_time': self.update_time.isoformat(),
-            'start_date': self.start_date.isoformat(),
-            'end_date': self.end_date.isoformat(),
-            'name': self.name,
-            'year': self.year,
-            'season': self.season,
-            'basin': self.basin,
-            'source_info': self.source_info,
-            'invest': self.invest,
-            'source_method': self.source_method,
-            'source_url': self.source_url,
-            'source': self.source,
-            'ace': self.ace,
-            'prob_2day': self.prob_2day,
-            'prob_5day': self.prob_5day,
-            'risk_2day': self.risk_2day,
-            'risk_5day': self.risk_5day,
-            'realtime': self.realtime,
-            "track": track
+        return track
+
+    def serialize_columnar_track(self, packed=False, index=None):
+        """Observed and forecast track as parallel arrays. Dates are seconds since the epoch, types and basins are
+        indices into their dictionaries. Forecast points start at forecast_start, and have no basin. index selects
+        observed points, see track_index"""
+
+        forecast = self.forecast
+
+        dates = epoch_seconds(take(self.date, index))
+        lat, lon, vmax, mslp, types = [take(values, index) for values in
+                                       (self.lat, self.lon, self.vmax, self.mslp, self.type)]
+        observed = len(dates)
+
+        if forecast:
+            dates += epoch_seconds(np.datetime64(forecast.init, "s") + np.asarray(forecast.fhr, dtype="timedelta64[h]"))
+            lat += forecast.lat
+            lon += forecast.lon
+            vmax += forecast.vmax
+            mslp += forecast.mslp
+            types += forecast.type
+
+        type_dictionary, type_codes = dictionary_encode(types)
+        basin_dictionary, basin_codes = dictionary_encode(map_basins(take(self.wmo_basin, index)))
+
+        track = {
+            "points": len(dates),
+            "forecast_start": observed,
+            "date": dates,
+            "lat": lat,
+            "lon": lon,
+            "wind": nan_to_none(vmax),
+            "pressure": nan_to_none(mslp),
+            "type": type_codes,
+            "basin": basin_codes,
+            "types": type_dictionary,
+            "basins": basin_dictionary,
         }
 
-        if self.forecast:
-            storm["track"] = storm["track"] + self.forecast.serialize()
+        if packed:
+            for column, dtype in PACKED_DTYPES.items():
+                track[column] = pack_column(track[column], dtype)
+
+        return track
 
-        storm["plots"] = []
+    def geojson_features(self):
+        """GeoJSON features of the storm. Observed and forecast tracks as LineStrings, then every track point as a
+        Point"""
 
-        for plot in self.plot:
-            storm["plots"].append(plot.serialize())
+        storm = self.serialize()
+        track = storm.pop("track")
 
-        return storm
+        features = []
+
+        for forecast in (False, True):
+            coordinates = [[point["lon"], point["lat"]] for point in track if point["forecast"] is forecast]
+
+            # a line needs at least two positions
+            if len(coordinates) < 2:
+                continue
+
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "LineString", "coordinates": coordinates},
+                "properties": {**storm, "forecast": forecast}
+            })
+
+        for point in track:
+            properties = {key: value for key, value in point.items() if key not in ("lat", "lon")}
+
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [point["lon"], point["lat"]]},
+                "properties": {"storm_id": self.id, **properties}
+            })
+
+        return features
 
     @property
     def storm_object(self):
@@ -159,6 +470,14 @@ class Storm(db.Model):
             "wmo_basin": self.wmo_basin
         }
 
+    @property
+    def fingerprint(self):
+        """Hash of the data storm plots are rendered from. Changes whenever the track or forecast changes"""
+
+        forecast_init = self.forecast.init if self.forecast else None
+
+        return get_fingerprint(self.date, self.lat, self.lon, self.vmax, self.mslp, forecast_init)
+
 
 class StormForecast(db.Model):
     __tablename__ = "storm_forecast"
@@ -166,15 +485,15 @@ class StormForecast(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     storm_id = db.Column(db.String, db.ForeignKey('storm.id'), nullable=False)
     init = db.Column(db.DateTime, nullable=False)
-    fhr = db.Column(MutableList.as_mutable(PickleType), nullable=False)
-    lat = db.Column(MutableList.as_mutable(PickleType), nullable=False)
-    lon = db.Column(MutableList.as_mutable(PickleType), nullable=False)
-    vmax = db.Column(MutableList.as_mutable(PickleType), nullable=False)
-    mslp = db.Column(MutableList.as_mutable(PickleType), nullable=False)
-    type = db.Column(MutableList.as_mutable(PickleType), nullable=False)
-    windrad = db.Column(MutableList.as_mutable(PickleType), nullable=False)
-    cumulative_ace = db.Column(MutableList.as_mutable(PickleType), nullable=False)
-    cumulative_ace_fhr = db.Column(MutableList.as_mutable(PickleType), nullable=False)
+    fhr = db.Column(track_array(db.Integer), nullable=False)
+    lat = db.Column(track_array(db.Float), nullable=False)
+    lon = db.Column(track_array(db.Float), nullable=False)
+    vmax = db.Column(track_array(db.Float), nullable=False)
+    mslp = db.Column(track_array(db.Float), nullable=False)
+    type = db.Column(track_array(db.String), nullable=False)
+    windrad = db.Column(track_json(), nullable=False)
+    cumulative_ace = db.Column(track_array(db.Float), nullable=False)
+    cumulative_ace_fhr = db.Column(track_array(db.Integer), nullable=False)
 
     storm = db.relationship("Storm", back_populates="forecast")
 
@@ -189,27 +508,45 @@ class StormForecast(db.Model):
     def serialize(self):
         """Return object data in easily serializable format"""
 
-        track = []
-        for idx, _ in enumerate(self.lat):
-            mslp = None if isnan(self.mslp[idx]) else self.mslp[idx]
-            vmax = None if isnan(self.vmax[idx]) else self.vmax[idx]
-
-            forecast_datetime = (self.init + timedelta(hours=self.fhr[idx])).isoformat()
-
-            forecast = {
-                "date": forecast_datetime,
-                "lat": self.lat[idx],
-                "lon": self.lon[idx],
-                "wind": vmax,
-                "pressure": mslp,
-                "type": self.type[idx],
+        # forecast dates are the init time offset by each forecast hour
+        dates = isoformat_dates(np.datetime64(self.init, "s") + np.asarray(self.fhr, dtype="timedelta64[h]"))
+        vmax = nan_to_none(self.vmax)
+        mslp = nan_to_none(self.mslp)
+
+        track = [
+            {
+                "date": date,
+                "lat": lat,
+                "lon": lon,
+                "wind": wind,
+                "pressure": pressure,
+                "type": storm_type,
                 "forecast": True,
             }
-
-            track.append(forecast)
+            for date, lat, lon, wind, pressure, storm_type in zip(dates, self.lat, self.lon, vmax, mslp, self.type)
+        ]
 
         return track
 
+    @property
+    def forecast_object(self):
+        """The forecast as tropycal's latest_forecast dict"""
+
+        return {
+            "init": self.init,
+            "fhr": list(self.fhr),
+            "lat": list(self.lat),
+            "lon": list(self.lon),
+            "vmax": list(self.vmax),
+            "mslp": list(self.mslp),
+            "type": list(self.type),
+            # JSON columns return wind radii thresholds as strings
+            "windrad": [{int(key): value for key, value in radii.items()} if isinstance(radii, dict) else radii
+                        for radii in self.windrad],
+            "cumulative_ace": list(self.cumulative_ace),
+            "cumulative_ace_fhr": list(self.cumulative_ace_fhr),
+        }
+
 
 class StormPlot(db.Model):
     __tablename__ = "storm_plot"
@@ -219,14 +556,19 @@ class StormPlot(db.Model):
     updated_on = db.Column(db.DateTime, nullable=False)
     plot_type = db.Column(db.String, nullable=False)
     file_path = db.Column(db.String, nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=True)
+    # optimized images of the plot, see optimizer.optimize_plot
+    variants = db.Column(JSONB().with_variant(PickleType(), "sqlite"), nullable=True)
 
     storm = db.relationship("Storm", back_populates="plot", )
 
-    def __init__(self, storm_id, updated_on, plot_type, file_path):
+    def __init__(self, storm_id, updated_on, plot_type, file_path, fingerprint=None, variants=None):
         self.storm_id = storm_id
         self.updated_on = updated_on
         self.plot_type = plot_type
         self.file_path = file_path
+        self.fingerprint = fingerprint
+        self.variants = variants
 
     def __repr__(self):
         return '<StormPlot %r>' % self.id
@@ -237,5 +579,6 @@ class StormPlot(db.Model):
         return {
             "updated_on": self.updated_on.isoformat(),
             "plot_type": self.plot_type,
-            "url": MEDIA_URL + self.file_path
+            "url": MEDIA_URL + self.file_path,
+            "variants": serialize_variants(self.variants)
         }
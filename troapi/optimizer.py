@@ -0,0 +1,91 @@
+"""Plot OPTIMIZER
+
+Post-render stage of the plot pipeline. Matplotlib writes full size PNGs at default settings, which is a lot to
+download on a slow mobile link. Every rendered plot is recompressed, and WebP and thumbnail variants of it are
+written next to it, so clients can pick the cheapest image that fits.
+"""
+
+import os
+
+from troapi.config import SETTINGS
+
+PLOT_WEBP_QUALITY = int(SETTINGS.get("PLOT_WEBP_QUALITY", 80))
+PLOT_THUMBNAIL_WIDTHS = [int(width) for width in str(SETTINGS.get("PLOT_THUMBNAIL_WIDTHS", "320,640,1024")).split(",")
+                         if width.strip()]
+
+# formats every size is written in
+VARIANT_FORMATS = ("png", "webp")
+
+
+def variant_file_path(file_path, image_format, width=None):
+    """File path of a variant of a plot, next to it. The full size PNG is the plot itself"""
+
+    base, _ = os.path.splitext(file_path)
+    suffix = f"_w{width}" if width else ""
+
+    return f"{base}{suffix}.{image_format}"
+
+
+def variant_file_paths(file_path, variants):
+    """File paths of a plot and all of its variants"""
+
+    return [file_path] + [variant["file_path"] for variant in variants or [] if variant["file_path"] != file_path]
+
+
+def save_image(image, path, image_format):
+    """Write an image through a temporary file, so a partly written image is never served"""
+
+    temp_path = f"{path}.tmp"
+
+    if image_format == "png":
+        image.save(temp_path, "PNG", optimize=True)
+    else:
+        image.save(temp_path, "WEBP", quality=PLOT_WEBP_QUALITY, method=6)
+
+    return temp_path
+
+
+def optimize_plot(upload_folder, file_path):
+    """Recompress a rendered PNG in place, and write its WebP and thumbnail variants. Returns the variants, with
+    the format, dimensions, size in bytes and file path of each, the full size PNG first"""
+
+    from PIL import Image
+
+    path = os.path.join(upload_folder, file_path)
+
+    with Image.open(path) as image:
+        image.load()
+
+    # matplotlib writes an alpha channel even for opaque figures
+    if image.mode == "RGBA" and image.getchannel("A").getextrema() == (255, 255):
+        image = image.convert("RGB")
+
+    variants = []
+
+    widths = [None] + sorted(width for width in set(PLOT_THUMBNAIL_WIDTHS) if width < image.width)
+
+    for width in widths:
+        resized = image if width is None else image.resize((width, round(image.height * width / image.width)),
+                                                           Image.LANCZOS)
+
+        for image_format in VARIANT_FORMATS:
+            variant_path = variant_file_path(file_path, image_format, width)
+            full_path = os.path.join(upload_folder, variant_path)
+
+            temp_path = save_image(resized, full_path, image_format)
+
+            # the original is only replaced by a smaller one
+            if full_path == path and os.path.getsize(temp_path) >= os.path.getsize(path):
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, full_path)
+
+            variants.append({
+                "format": image_format,
+                "width": resized.width,
+                "height": resized.height,
+                "bytes": os.path.getsize(full_path),
+                "file_path": variant_path,
+            })
+
+    return variants
@@ -0,0 +1,193 @@
+"""Plot RENDERER
+
+Renders tropycal plots in a pool of worker processes, so that matplotlib/Cartopy work runs across cores
+instead of blocking the ingestion cycle on the scheduler thread. Every rendered plot goes through the optimizer
+before its job completes.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from troapi.config import SETTINGS
+from troapi.optimizer import optimize_plot
+
+UPLOAD_FOLDER = SETTINGS.get("UPLOAD_FOLDER")
+
+# Natural Earth scales used by tropycal, 'm' resolution for storm plots and 'l' for the 'all' summary
+PRELOAD_SCALES = ("50m", "110m")
+
+# storm_id is None for summary plots. The payload is the storm dict a RealtimeStorm is built from,
+# or the realtime object and domain for summary plots. file_path is relative to the upload folder.
+# forecast is the storm's already fetched latest forecast, tropycal fetches it again when it is missing
+PlotJob = namedtuple("PlotJob", ["storm_id", "plot_type", "payload", "file_path", "forecast"], defaults=(None,))
+# variants are the optimized images written for the plot, see optimizer.optimize_plot
+PlotResult = namedtuple("PlotResult", ["storm_id", "plot_type", "file_path", "error", "variants"], defaults=(None,))
+
+
+def init_worker():
+    """Set up a worker process once, before it renders any plot"""
+
+    import matplotlib
+
+    # tell matplotlib to use backend that writes to files on the server side
+    matplotlib.use('Agg')
+
+    import cartopy.feature as cfeature
+
+    # read the basemap geometries once, Cartopy keeps them cached for the life of the process
+    for feature in (cfeature.OCEAN, cfeature.LAKES, cfeature.LAND, cfeature.STATES, cfeature.BORDERS,
+                    cfeature.COASTLINE):
+        for scale in PRELOAD_SCALES:
+            try:
+                list(feature.with_scale(scale).geometries())
+            except Exception as e:
+                logging.warning(f"[RENDERER]: Could not preload {feature.name} at {scale}, {e}")
+
+
+def use_basemap_cache(tropycal_obj):
+    """Have a storm or realtime object draw the map layer of its plots from this worker's basemap cache"""
+
+    from troapi.basemap import PLOT_BASEMAP_CACHE_SIZE, BasemapTrackPlot
+
+    if PLOT_BASEMAP_CACHE_SIZE > 0:
+        # tropycal plots with the plot_obj already set on the object, if any
+        tropycal_obj.plot_obj = BasemapTrackPlot()
+
+    return tropycal_obj
+
+
+def plot_observed_track(realtime_storm, save_path):
+    realtime_storm.plot(save_path=save_path)
+
+
+def plot_latest_forecast(realtime_storm, save_path):
+    # tropycal writes forecast plots into a directory, with a name of its own
+    temp_dir = tempfile.mkdtemp()
+
+    try:
+        realtime_storm.plot_forecast_realtime(save_path=temp_dir, ssl_certificate=False)
+
+        for filename in os.listdir(temp_dir):
+            f = os.path.join(temp_dir, filename)
+
+            if f.endswith("_track.png"):
+                # move temp file to save_path
+                shutil.move(f, save_path)
+                return
+
+        raise RuntimeError("Forecast plot was not created")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def plot_forecast_model_tracks(realtime_storm, save_path):
+    realtime_storm.plot_models(save_path=save_path)
+
+
+def plot_forecast_gefs_density(realtime_storm, save_path):
+    realtime_storm.plot_ensembles(save_path=save_path)
+
+
+STORM_PLOTTERS = {
+    "observed_track": plot_observed_track,
+    "latest_forecast": plot_latest_forecast,
+    "forecast_model_tracks": plot_forecast_model_tracks,
+    "forecast_gefs_density": plot_forecast_gefs_density,
+}
+
+
+def render_plot(job):
+    """Render a single plot job. Runs inside a worker process"""
+
+    import matplotlib.pyplot as plt
+
+    save_path = os.path.join(UPLOAD_FOLDER, job.file_path)
+
+    # make dir recursively, dont raise if exists
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+
+    try:
+        if job.plot_type == "summary":
+            realtime_obj = use_basemap_cache(job.payload["realtime"])
+            realtime_obj.plot_summary(domain=job.payload["domain"], ssl_certificate=False, save_path=save_path)
+        else:
+            from tropycal.realtime import RealtimeStorm
+
+            realtime_storm = use_basemap_cache(RealtimeStorm(job.payload))
+
+            if job.forecast is not None:
+                realtime_storm.latest_forecast = job.forecast
+
+            STORM_PLOTTERS[job.plot_type](realtime_storm, save_path)
+    except Exception as e:
+        return PlotResult(job.storm_id, job.plot_type, None, str(e))
+    finally:
+        # never leak figures across jobs in a long lived worker
+        plt.close("all")
+
+    try:
+        variants = optimize_plot(UPLOAD_FOLDER, job.file_path)
+    except Exception as e:
+        # the plot as rendered is still usable
+        logging.warning(f"[RENDERER]: Could not optimize {job.file_path}, {e}")
+        variants = None
+
+    return PlotResult(job.storm_id, job.plot_type, job.file_path, None, variants)
+
+
+class PlotRenderer(object):
+    """Process pool backed plot renderer"""
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        # the pool is only started on first use, web workers that never render never pay for it
+        with self._lock:
+            if self._executor is None:
+                logging.info(f"[RENDERER]: Starting plot rendering pool with {self.max_workers} workers")
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_worker)
+            return self._executor
+
+    def submit(self, job):
+        return self.executor.submit(render_plot, job)
+
+    def render(self, jobs):
+        """Render plot jobs in the pool, and wait for all of them. Results are returned in job order"""
+
+        futures = [self.submit(job) for job in jobs]
+
+        results = []
+        for job, future in zip(jobs, futures):
+            try:
+                results.append(future.result())
+            except BrokenProcessPool as e:
+                # a worker died, start a fresh pool on the next submit
+                self.shutdown()
+                results.append(PlotResult(job.storm_id, job.plot_type, None, str(e)))
+            except Exception as e:
+                results.append(PlotResult(job.storm_id, job.plot_type, None, str(e)))
+
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+renderer = PlotRenderer(max_workers=int(SETTINGS.get("PLOT_RENDER_WORKERS", 2)))
+
+# plots rendered on demand by web requests. Every web worker process starts a pool of its own, kept small so a
+# burst of misses can't start more render processes than the host has cores
+on_demand_renderer = PlotRenderer(max_workers=int(SETTINGS.get("PLOT_ON_DEMAND_RENDER_WORKERS", 1)))
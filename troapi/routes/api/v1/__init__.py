@@ -1,4 +1,5 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, Response, jsonify, request
+from werkzeug.http import is_resource_modified
 
 
 # GENERIC Error
@@ -9,6 +10,42 @@ def error(status=400, detail='Bad Request'):
     }), status
 
 
+# Media type of each storm track format
+TRACK_FORMAT_MIMETYPES = {
+    'json': 'application/json',
+    'columnar': 'application/vnd.troapi.columnar+json',
+    'packed': 'application/vnd.troapi.packed+json',
+}
+
+
+# Track format asked for with the format query parameter, or negotiated from the Accept header
+def get_track_format():
+    track_format = request.args.get('format')
+
+    if track_format:
+        return track_format if track_format in TRACK_FORMAT_MIMETYPES else None
+
+    mimetype = request.accept_mimetypes.best_match(list(TRACK_FORMAT_MIMETYPES.values()),
+                                                   default=TRACK_FORMAT_MIMETYPES['json'])
+
+    return next(key for key, value in TRACK_FORMAT_MIMETYPES.items() if value == mimetype)
+
+
+# Cached response, answered with 304 when the client already has it
+def cached_response(cached, mimetype='application/json'):
+    if is_resource_modified(request.environ, etag=cached.etag, last_modified=cached.updated_on):
+        response = Response(cached.body, mimetype=mimetype)
+    else:
+        response = Response(status=304)
+
+    response.set_etag(cached.etag)
+    response.last_modified = cached.updated_on
+    response.vary.add('Accept')
+
+    return response
+
+
 endpoints = Blueprint('endpoints', __name__)
 
 import troapi.routes.api.v1.storm_router
+import troapi.routes.api.v1.tile_router
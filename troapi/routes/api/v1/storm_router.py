@@ -1,12 +1,152 @@
 import logging
-import io
+import math
+from datetime import datetime
+
 from flask import send_file
 
-from flask import jsonify, request
+from flask import Response, jsonify, request, stream_with_context
+
+from troapi import app
+
+from troapi.errors import StormNotFound, StormHasNoForecast, StormPlotError
+from troapi.models.storm import BASIN_MAPPING, SIMPLIFY_LEVELS, STEP_LEVELS, STORM_FIELDS, STORM_PARTS
+from troapi.routes.api.v1 import endpoints, error, cached_response, get_track_format, TRACK_FORMAT_MIMETYPES
+from troapi.services import StormService, CacheService
+from troapi.services.cache_service import CACHED_TRACK_THINNING, get_realtime_storms_key, get_storm_key
+
+
+def parse_floats(value, count):
+    values = [float(v) for v in value.split(',')]
+
+    if len(values) != count:
+        raise ValueError(f"expected {count} comma separated numbers")
+
+    return values
+
+
+def check_position(lat, lon, name):
+    """Raises ValueError unless lat and lon are within [-90, 90] and [-180, 180]"""
+
+    if not (math.isfinite(lat) and -90 <= lat <= 90):
+        raise ValueError(f"{name} latitude must be within -90 and 90")
+    if not (math.isfinite(lon) and -180 <= lon <= 180):
+        raise ValueError(f"{name} longitude must be within -180 and 180")
+
+
+def get_storm_filters(args):
+    """Archive filters from query parameters. Raises ValueError on invalid values"""
+
+    filters = {}
+
+    basin = args.get('basin')
+    if basin:
+        # basin name, or its code
+        codes = {code: name for name, code in BASIN_MAPPING.items()}
+        filters['basin'] = codes.get(basin.upper(), basin)
+
+    if args.get('season'):
+        filters['season'] = int(args['season'])
+    if args.get('start'):
+        filters['start'] = datetime.fromisoformat(args['start'])
+    if args.get('end'):
+        filters['end'] = datetime.fromisoformat(args['end'])
+    if args.get('min_wind'):
+        filters['min_wind'] = float(args['min_wind'])
+    if args.get('max_pressure'):
+        filters['max_pressure'] = float(args['max_pressure'])
+
+    if args.get('bbox'):
+        min_lon, min_lat, max_lon, max_lat = filters['bbox'] = parse_floats(args['bbox'], 4)
+
+        check_position(min_lat, min_lon, 'bbox')
+        check_position(max_lat, max_lon, 'bbox')
+
+        if min_lat > max_lat:
+            raise ValueError("bbox min_lat is above max_lat")
+        # a box across the antimeridian is asked for as the two boxes on either side of it
+        if min_lon > max_lon:
+            raise ValueError("bbox min_lon is above max_lon, split boxes crossing the antimeridian")
+
+    if args.get('near'):
+        filters['near'] = parse_floats(args['near'], 2)
+        filters['radius'] = float(args.get('radius', 100))
+
+        check_position(*filters['near'], 'near')
+
+        if not (math.isfinite(filters['radius']) and filters['radius'] > 0):
+            raise ValueError("radius must be a positive number of km")
+
+    return filters
+
+
+def get_projection(args):
+    """Storm fields and parts asked for. No fields means every field, and no include every part. Raises ValueError on
+    unknown ones"""
+
+    fields = args.get('fields')
+    fields = fields.split(',') if fields else None
+
+    include = args.get('include')
+    include = include.split(',') if include else None
+
+    unknown = [field for field in fields or [] if field not in STORM_FIELDS] + \
+              [part for part in include or [] if part not in STORM_PARTS]
+
+    if unknown:
+        raise ValueError(f"unknown fields {', '.join(unknown)}")
+
+    return fields, include
+
+
+def get_simplification(args):
+    """Simplification tolerance in degrees and downsampling step in hours, among the served levels. Raises ValueError
+    on other values"""
+
+    simplify = float(args['simplify']) if args.get('simplify') else None
+    step = int(args['step']) if args.get('step') else None
+
+    if simplify is not None and simplify not in SIMPLIFY_LEVELS:
+        raise ValueError(f"simplify must be one of {', '.join(f'{level:g}' for level in SIMPLIFY_LEVELS)} degrees")
+    if step is not None and step not in STEP_LEVELS:
+        raise ValueError(f"step must be one of {', '.join(str(level) for level in STEP_LEVELS)} hours")
+
+    return simplify, step
+
+
+@endpoints.route('/storms', strict_slashes=False, methods=['GET'])
+def get_storms():
+    """Get archived and realtime storms, filtered by basin, season, date range, intensity, bounding box or distance
+    from a point"""
+    logging.info('[ROUTER]: Getting storms')
+
+    track_format = get_track_format()
+
+    if not track_format:
+        return error(status=400, detail='Unsupported track format, use json, columnar or packed')
+
+    try:
+        fields, include = get_projection(request.args)
+        filters = get_storm_filters(request.args)
+        simplify, step = get_simplification(request.args)
+    except ValueError as e:
+        return error(status=400, detail=f'Invalid filter, {e}')
+
+    try:
+        result, next_cursor = StormService.get_storms(cursor=request.args.get('cursor'), fields=fields,
+                                                      include=include, **filters)
+    except ValueError:
+        return error(status=400, detail='Invalid cursor')
+    except Exception as e:
+        logging.error('[ROUTER]: ' + str(e))
+        return error(status=500, detail='Generic Error')
+
+    response = {
+        "data": [item.serialize(include, track_format, fields, simplify, step) for item in result],
+        "count": len(result),
+        "next": next_cursor
+    }
 
-from troapi.errors import StormNotFound, StormHasNoForecast
-from troapi.routes.api.v1 import endpoints, error
-from troapi.services import StormService
+    return track_response(response, TRACK_FORMAT_MIMETYPES[track_format]), 200
 
 
 @endpoints.route('/storms/realtime', strict_slashes=False, methods=['GET'])
@@ -14,26 +154,113 @@ def get_realtime_storms():
     """Get storms"""
     logging.info('[ROUTER]: Getting realtime storms')
 
-    include = request.args.get('include')
-    include = include.split(',') if include else []
+    track_format = get_track_format()
+
+    if not track_format:
+        return error(status=400, detail='Unsupported track format, use json, columnar or packed')
 
     try:
-        result = StormService.get_realtime_storms()
+        fields, include = get_projection(request.args)
+        simplify, step = get_simplification(request.args)
+    except ValueError as e:
+        return error(status=400, detail=f'Invalid filter, {e}')
+
+    mimetype = TRACK_FORMAT_MIMETYPES[track_format]
+
+    try:
+        # cached responses hold full storms, at the cached thinning levels
+        cached = CacheService.get(get_realtime_storms_key(track_format, simplify, step)) \
+            if fields is None and include is None and (simplify, step) in CACHED_TRACK_THINNING else None
+
+        if cached:
+            return cached_response(cached, mimetype)
+
+        result = StormService.get_realtime_storms(fields, include)
     except Exception as e:
         logging.error('[ROUTER]: ' + str(e))
         return error(status=500, detail='Generic Error')
 
     response = {
-        "data": [item.serialize(include) for item in result],
+        "data": [item.serialize(include, track_format, fields, simplify, step) for item in result],
         "count": len(result)
     }
 
-    return jsonify(**response), 200
+    return track_response(response, mimetype), 200
+
+
+def track_response(payload, mimetype):
+    response = jsonify(**payload)
+    response.mimetype = mimetype
+    response.vary.add('Accept')
+
+    return response
+
+
+def stream_geojson(storms):
+    yield '{"type":"FeatureCollection","features":['
+
+    first = True
+    for storm in storms:
+        for feature in storm.geojson_features():
+            yield ("" if first else ",") + app.json.dumps(feature, separators=(",", ":"))
+            first = False
+
+    yield ']}'
+
+
+def stream_ndjson(storms, include):
+    for storm in storms:
+        yield app.json.dumps(storm.serialize(include), separators=(",", ":")) + "\n"
+
+
+@endpoints.route('/storms/realtime/export', strict_slashes=False, methods=['GET'])
+def export_realtime_storms():
+    """Stream realtime storms one at a time, as a GeoJSON FeatureCollection or as NDJSON"""
+    logging.info('[ROUTER]: Exporting realtime storms')
+
+    export_format = request.args.get('format', 'geojson')
+
+    if export_format not in ('geojson', 'ndjson'):
+        return error(status=400, detail=f"Unsupported export format {export_format}, use geojson or ndjson")
+
+    try:
+        _, include = get_projection({'include': request.args.get('include')})
+    except ValueError as e:
+        return error(status=400, detail=f'Invalid filter, {e}')
+
+    # features always hold the full storm
+    if include and export_format == 'geojson':
+        return error(status=400, detail='include only applies to the ndjson format')
+
+    storms = StormService.iter_realtime_storms()
+
+    if export_format == 'geojson':
+        return Response(stream_with_context(stream_geojson(storms)), mimetype='application/geo+json')
+
+    return Response(stream_with_context(stream_ndjson(storms, include)), mimetype='application/x-ndjson')
 
 
 @endpoints.route('/storms/realtime/<storm_id>', strict_slashes=False, methods=['GET'])
 def get_storm(storm_id):
+    track_format = get_track_format()
+
+    if not track_format:
+        return error(status=400, detail='Unsupported track format, use json, columnar or packed')
+
     try:
+        simplify, step = get_simplification(request.args)
+    except ValueError as e:
+        return error(status=400, detail=f'Invalid filter, {e}')
+
+    mimetype = TRACK_FORMAT_MIMETYPES[track_format]
+
+    try:
+        cached = CacheService.get(get_storm_key(storm_id, track_format, simplify, step)) \
+            if (simplify, step) in CACHED_TRACK_THINNING else None
+
+        if cached:
+            return cached_response(cached, mimetype)
+
         storm = StormService.get_storm(storm_id)
     except StormNotFound as e:
         logging.error('[ROUTER]: ' + e.message)
@@ -42,9 +269,9 @@ def get_storm(storm_id):
         logging.error('[ROUTER]: ' + str(e))
         return error(status=500, detail='Generic Error')
 
-    response = storm.serialize()
+    response = storm.serialize(track_format=track_format, simplify=simplify, step=step)
 
-    return jsonify(**response), 200
+    return track_response(response, mimetype), 200
 
 
 @endpoints.route('/storms/realtime/<storm_id>/plot', strict_slashes=False, methods=['GET'])
@@ -54,26 +281,19 @@ def get_storm_plot(storm_id):
     if "forecast" in args:
         plot_forecast = True
     try:
-        storm_plot_file = StormService.plot_storm(storm_id, forecast=plot_forecast)
-
-        if storm_plot_file:
-            plot_data = io.BytesIO()
-            with open(storm_plot_file.name, 'rb') as f:
-                plot_data.write(f.read())
-            plot_data.seek(0)
-
-            # delete temp file
-            storm_plot_file.close()
+        plot_path = StormService.plot_storm(storm_id, forecast=plot_forecast)
 
-            return send_file(plot_data, mimetype='image/png')
-        else:
-            return error(status=500, detail='Error Plotting')
+        # stream the rendered file straight from disk
+        return send_file(plot_path, mimetype='image/png', conditional=True)
     except StormNotFound as e:
         logging.error('[ROUTER]: ' + e.message)
         return error(status=404, detail=e.message)
     except StormHasNoForecast as e:
         logging.error('[ROUTER]: ' + e.message)
         return error(status=400, detail=e.message)
+    except StormPlotError as e:
+        logging.error('[ROUTER]: ' + e.message)
+        return error(status=500, detail='Error Plotting')
     except Exception as e:
         logging.error('[ROUTER]: ' + str(e))
         return error(status=500, detail='Generic Error')
@@ -90,4 +310,7 @@ def get_recent_plot():
         logging.error('[ROUTER]: ' + str(e))
         return error(status=500, detail='Generic Error')
 
-    return jsonify(plot), 200
+    if not plot:
+        return error(status=404, detail='No summary plot yet')
+
+    return jsonify(plot.serialize()), 200
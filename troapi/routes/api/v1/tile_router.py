@@ -0,0 +1,28 @@
+import logging
+
+from troapi.errors import TilesUnavailable
+from troapi.routes.api.v1 import endpoints, error, cached_response
+from troapi.services import TileService
+
+MAX_ZOOM = 22
+
+TILE_MIMETYPE = 'application/vnd.mapbox-vector-tile'
+
+
+@endpoints.route('/tiles/<int:z>/<int:x>/<int:y>', strict_slashes=False, methods=['GET'])
+@endpoints.route('/tiles/<int:z>/<int:x>/<int:y>.mvt', strict_slashes=False, methods=['GET'])
+@endpoints.route('/tiles/<int:z>/<int:x>/<int:y>.pbf', strict_slashes=False, methods=['GET'])
+def get_tile(z, x, y):
+    if z > MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        return error(status=400, detail=f'Invalid tile {z}/{x}/{y}')
+
+    try:
+        tile = TileService.get_tile(z, x, y)
+    except TilesUnavailable as e:
+        logging.error('[ROUTER]: ' + e.message)
+        return error(status=501, detail=e.message)
+    except Exception as e:
+        logging.error('[ROUTER]: ' + str(e))
+        return error(status=500, detail='Generic Error')
+
+    return cached_response(tile, mimetype=TILE_MIMETYPE)
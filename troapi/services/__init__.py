@@ -1 +1,4 @@
 from troapi.services.storm_service import StormService
+from troapi.services.cache_service import CacheService
+from troapi.services.tile_service import TileService
+from troapi.services.retention_service import RetentionService
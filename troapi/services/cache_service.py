@@ -0,0 +1,176 @@
+"""Cache SERVICE """
+
+import hashlib
+import logging
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from troapi import app, db
+from troapi.config import SETTINGS
+from troapi.helpers import transaction
+from troapi.models import CachedResponse
+from troapi.models.storm import SIMPLIFY_LEVELS, STEP_LEVELS
+
+REALTIME_STORMS_KEY = "storms:realtime"
+
+
+def parse_thinning(value):
+    """Thinning levels from comma separated simplify:step pairs, either one left empty. The full track comes
+    first"""
+
+    levels = [(None, None)]
+
+    for pair in value.split(","):
+        if not pair.strip():
+            continue
+
+        simplify, _, step = pair.partition(":")
+        level = (float(simplify) if simplify.strip() else None, int(step) if step.strip() else None)
+
+        if level[0] not in (None,) + SIMPLIFY_LEVELS or level[1] not in (None,) + STEP_LEVELS:
+            logging.warning(f"[SERVICE]: Not caching unsupported track thinning {pair}")
+            continue
+
+        if level not in levels:
+            levels.append(level)
+
+    return levels
+
+
+# thinning levels the realtime storm responses are cached at, besides the full track. Every level costs a
+# serialization of every realtime storm in every track format per ingestion cycle, only cache those clients use.
+# The others are serialized on request
+CACHED_TRACK_THINNING = parse_thinning(str(SETTINGS.get("CACHED_TRACK_THINNING", "")))
+
+
+def format_key(key, track_format, simplify=None, step=None):
+    # the default json format of the full track keeps the plain key
+    if step:
+        key = f"{key}.step-{step}"
+    if simplify:
+        key = f"{key}.simplify-{simplify:g}"
+
+    return key if track_format == "json" else f"{key}.{track_format}"
+
+
+def get_realtime_storms_key(track_format="json", simplify=None, step=None):
+    return format_key(REALTIME_STORMS_KEY, track_format, simplify, step)
+
+
+def get_storm_key(storm_id, track_format="json", simplify=None, step=None):
+    return format_key(f"{REALTIME_STORMS_KEY}:{storm_id}", track_format, simplify, step)
+
+
+def encode(payload):
+    # same encoding jsonify uses outside debug mode
+    return app.json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+def decode(body):
+    return app.json.loads(body)
+
+
+def upsert(rows):
+    """Insert or update cached responses in a single statement, so concurrent writers of the same key never
+    conflict. Last-Modified only moves when the content actually changed"""
+
+    table = CachedResponse.__table__
+    insert = postgresql.insert if db.engine.dialect.name == "postgresql" else sqlite.insert
+
+    statement = insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.key],
+        set_={"body": statement.excluded.body, "etag": statement.excluded.etag,
+              "updated_on": statement.excluded.updated_on},
+        where=table.c.etag != statement.excluded.etag)
+
+    db.session.execute(statement, rows)
+
+
+class CacheService(object):
+    """Pre-serialized API responses, written by the ingestion job and read by the API"""
+
+    @staticmethod
+    def get(key):
+        logging.info(f"[SERVICE]: Getting cached response {key}")
+        logging.info('[DB]: QUERY')
+
+        return CachedResponse.query.get(key)
+
+    @staticmethod
+    def get_many(keys):
+        """Cached responses by key, for the keys that are cached"""
+
+        logging.info('[DB]: QUERY')
+
+        return {cached.key: cached for cached in CachedResponse.query.filter(CachedResponse.key.in_(keys))}
+
+    @staticmethod
+    def set(key, body):
+        """Store a body, encoded unless it already is bytes. Returns the cached response"""
+
+        if not isinstance(body, bytes):
+            body = encode(body)
+
+        cached = CachedResponse(key=key, body=body, etag=hashlib.sha256(body).hexdigest(),
+                                updated_on=datetime.utcnow())
+
+        with transaction():
+            upsert([{"key": key, "body": body, "etag": cached.etag, "updated_on": cached.updated_on}])
+
+        return cached
+
+    @staticmethod
+    def delete_prefix(prefix, keep=None):
+        """Remove keys under prefix, except those under keep"""
+
+        query = CachedResponse.query.filter(CachedResponse.key.startswith(prefix))
+        if keep:
+            query = query.filter(~CachedResponse.key.startswith(keep))
+
+        with transaction():
+            deleted = query.delete(synchronize_session=False)
+
+        logging.info(f"[SERVICE]: Deleted {deleted} cached responses under {prefix}")
+
+    @staticmethod
+    def set_many(payloads, prefix=None):
+        """Store encoded payloads by key. Keys under prefix that are not in payloads are removed"""
+
+        now = datetime.utcnow()
+
+        rows = []
+        for key, payload in payloads.items():
+            body = encode(payload)
+            rows.append({"key": key, "body": body, "etag": hashlib.sha256(body).hexdigest(), "updated_on": now})
+
+        with transaction():
+            if rows:
+                upsert(rows)
+
+            if prefix:
+                CachedResponse.query.filter(CachedResponse.key.startswith(prefix),
+                                            CachedResponse.key.notin_(list(payloads))) \
+                    .delete(synchronize_session=False)
+
+    @staticmethod
+    def replace_many(payloads):
+        """Store encoded payloads by key, as (payload, etag) pairs. A key is only replaced while it is still cached
+        at etag, so a concurrent writer's newer content is never overwritten. Returns the number replaced"""
+
+        now = datetime.utcnow()
+        replaced = 0
+
+        with transaction():
+            for key, (payload, etag) in payloads.items():
+                body = encode(payload)
+                new_etag = hashlib.sha256(body).hexdigest()
+
+                if new_etag == etag:
+                    continue
+
+                replaced += CachedResponse.query.filter_by(key=key, etag=etag) \
+                    .update({"body": body, "etag": new_etag, "updated_on": now}, synchronize_session=False)
+
+        return replaced
@@ -0,0 +1,294 @@
+"""Retention SERVICE
+
+Rendered plots pile up on disk and in the database for as long as storms are active. The retention job removes
+those no longer worth keeping, in batches and off the ingestion path:
+
+- all but the latest PLOT_RETENTION_KEEP plots of each storm and plot type, and summary plots
+- plots older than PLOT_RETENTION_MAX_AGE_HOURS. The latest plot of a realtime storm, and the latest summary, are
+  kept whatever their age, as they are the ones served
+- the oldest plots, until plot files fit in PLOT_RETENTION_MAX_BYTES
+- files no plot references, once older than PLOT_RETENTION_ORPHAN_MINUTES, so files of renders that are not yet
+  committed are left alone
+"""
+
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+
+from troapi import app, db
+from troapi.config import SETTINGS
+from troapi.helpers import transaction
+from troapi.models import Storm, StormPlot, Plot, PlotFile
+from troapi.optimizer import variant_file_paths
+from troapi.services.storm_service import refresh_realtime_storms
+
+PLOT_FOLDERS = ("storm_plots", "summary_plots")
+
+PLOT_RETENTION_KEEP = int(SETTINGS.get("PLOT_RETENTION_KEEP", 3))
+PLOT_RETENTION_MAX_AGE_HOURS = float(SETTINGS.get("PLOT_RETENTION_MAX_AGE_HOURS", 72))
+PLOT_RETENTION_MAX_BYTES = int(SETTINGS.get("PLOT_RETENTION_MAX_BYTES", 0))
+PLOT_RETENTION_ORPHAN_MINUTES = float(SETTINGS.get("PLOT_RETENTION_ORPHAN_MINUTES", 60))
+PLOT_RETENTION_BATCH_SIZE = int(SETTINGS.get("PLOT_RETENTION_BATCH_SIZE", 500))
+
+
+class RetentionReport(object):
+    """What a retention run removed"""
+
+    def __init__(self):
+        self.storm_plots = 0
+        self.summary_plots = 0
+        self.files = 0
+        self.orphans = 0
+        self.bytes = 0
+        # storms that lost plots
+        self.storm_ids = set()
+
+    def __repr__(self):
+        return (f"<RetentionReport {self.storm_plots} storm plots, {self.summary_plots} summary plots, "
+                f"{self.files} files, {self.orphans} orphaned files, {self.bytes} bytes>")
+
+
+def batches(items, batch_size):
+    for i in range(0, len(items), batch_size):
+        yield items[i:i + batch_size]
+
+
+def file_size(file_path):
+    try:
+        return os.path.getsize(os.path.join(app.config['UPLOAD_FOLDER'], file_path))
+    except OSError:
+        return 0
+
+
+def referenced_file_paths(file_paths=None):
+    """Files of the storm and summary plots with file_paths, and of their variants, that are still referenced. All
+    referenced files without file_paths"""
+
+    referenced = set()
+
+    for model in (StormPlot, PlotFile):
+        query = db.session.query(model.file_path, model.variants)
+
+        if file_paths is not None:
+            query = query.filter(model.file_path.in_(file_paths))
+
+        for file_path, variants in query:
+            referenced.update(variant_file_paths(file_path, variants))
+
+    return referenced
+
+
+def remove_files(plots, report):
+    """Remove the files of plots, as (file_path, variants) pairs, unless another plot still references them"""
+
+    referenced = referenced_file_paths(list({file_path for file_path, _ in plots}))
+
+    for file_path, variants in plots:
+        for path in variant_file_paths(file_path, variants):
+            if path in referenced:
+                continue
+
+            size = file_size(path)
+
+            try:
+                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], path))
+            except FileNotFoundError:
+                continue
+
+            report.files += 1
+            report.bytes += size
+
+
+def ranked_storm_plots():
+    """Storm plots with their rank among plots of the same storm and type, newest first, and whether the storm is
+    realtime"""
+
+    rank = db.func.row_number().over(partition_by=(StormPlot.storm_id, StormPlot.plot_type),
+                                     order_by=(StormPlot.updated_on.desc(), StormPlot.id.desc())).label("rank")
+
+    return db.session.query(StormPlot.id, StormPlot.storm_id, StormPlot.file_path, StormPlot.variants,
+                            StormPlot.updated_on, Storm.realtime, rank) \
+        .outerjoin(Storm, Storm.id == StormPlot.storm_id).subquery()
+
+
+def ranked_summary_plots():
+    """Summary plots with their rank, newest first"""
+
+    rank = db.func.row_number().over(order_by=(Plot.created_on.desc(), Plot.id.desc())).label("rank")
+
+    return db.session.query(Plot.id, Plot.created_on, rank).subquery()
+
+
+def expired_storm_plots(keep, cutoff):
+    ranked = ranked_storm_plots()
+
+    # the latest plot of a realtime storm is the one served
+    served = and_(ranked.c.rank == 1, ranked.c.realtime.is_(True))
+
+    conditions = [ranked.c.rank > keep]
+    if cutoff:
+        conditions.append(and_(ranked.c.updated_on < cutoff, ~served))
+
+    return db.session.query(ranked.c.id, ranked.c.storm_id, ranked.c.file_path, ranked.c.variants) \
+        .filter(or_(*conditions)).all()
+
+
+def expired_summary_plots(keep, cutoff):
+    ranked = ranked_summary_plots()
+
+    conditions = [ranked.c.rank > keep]
+    if cutoff:
+        conditions.append(and_(ranked.c.created_on < cutoff, ranked.c.rank > 1))
+
+    return [plot_id for (plot_id,) in db.session.query(ranked.c.id).filter(or_(*conditions))]
+
+
+def delete_storm_plots(rows, batch_size, report):
+    """Delete storm plot rows, then the files no other plot references, a batch at a time"""
+
+    for batch in batches(rows, batch_size):
+        with transaction():
+            StormPlot.query.filter(StormPlot.id.in_([row.id for row in batch])).delete(synchronize_session=False)
+
+        report.storm_plots += len(batch)
+        report.storm_ids.update(row.storm_id for row in batch)
+
+        # files are only removed once no committed row references them
+        remove_files([(row.file_path, row.variants) for row in batch], report)
+
+
+def delete_summary_plots(plot_ids, batch_size, report):
+    """Delete summary plots and their files, a batch at a time"""
+
+    for batch in batches(plot_ids, batch_size):
+        plots = db.session.query(PlotFile.file_path, PlotFile.variants).filter(PlotFile.plot_id.in_(batch)).all()
+
+        with transaction():
+            PlotFile.query.filter(PlotFile.plot_id.in_(batch)).delete(synchronize_session=False)
+            Plot.query.filter(Plot.id.in_(batch)).delete(synchronize_session=False)
+
+        report.summary_plots += len(batch)
+
+        remove_files(plots, report)
+
+
+def oldest_plots_over(max_bytes):
+    """Storm plot rows and summary plot ids to delete, oldest first, for plot files to fit in max_bytes. Plots that
+    are served are never picked"""
+
+    sizes = {file_path: file_size(file_path) for file_path in referenced_file_paths()}
+    excess = sum(sizes.values()) - max_bytes
+
+    if excess <= 0:
+        return [], []
+
+    ranked = ranked_storm_plots()
+    storm_plots = db.session.query(ranked.c.updated_on, ranked.c.id, ranked.c.storm_id, ranked.c.file_path,
+                                   ranked.c.variants) \
+        .filter(or_(ranked.c.rank > 1, ranked.c.realtime.isnot(True))).all()
+
+    ranked = ranked_summary_plots()
+    summary_plots = db.session.query(ranked.c.created_on, ranked.c.id).filter(ranked.c.rank > 1).all()
+
+    summary_file_paths = {}
+    for plot_id, file_path, variants in db.session.query(PlotFile.plot_id, PlotFile.file_path, PlotFile.variants) \
+            .filter(PlotFile.plot_id.in_([plot_id for _, plot_id in summary_plots])):
+        summary_file_paths.setdefault(plot_id, []).extend(variant_file_paths(file_path, variants))
+
+    candidates = [(row.updated_on, "storm", row) for row in storm_plots] + \
+                 [(created_on, "summary", plot_id) for created_on, plot_id in summary_plots]
+
+    storm_rows, summary_ids = [], []
+
+    for _, kind, candidate in sorted(candidates, key=lambda candidate: candidate[0]):
+        if excess <= 0:
+            break
+
+        if kind == "storm":
+            storm_rows.append(candidate)
+            excess -= sum(sizes.get(path, 0) for path in variant_file_paths(candidate.file_path, candidate.variants))
+        else:
+            summary_ids.append(candidate)
+            excess -= sum(sizes.get(file_path, 0) for file_path in summary_file_paths.get(candidate, []))
+
+    return storm_rows, summary_ids
+
+
+def remove_orphan_files(grace_seconds, report):
+    """Remove plot files no plot references, and empty plot directories, once older than the grace period"""
+
+    upload_folder = app.config['UPLOAD_FOLDER']
+    referenced = referenced_file_paths()
+    threshold = time.time() - grace_seconds
+
+    for folder in PLOT_FOLDERS:
+        top = os.path.join(upload_folder, folder)
+
+        for root, _, names in os.walk(top, topdown=False):
+            for name in names:
+                path = os.path.join(root, name)
+
+                if os.path.relpath(path, upload_folder) in referenced:
+                    continue
+
+                try:
+                    if os.path.getmtime(path) > threshold:
+                        continue
+
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+
+                report.orphans += 1
+                report.bytes += size
+
+            # plot directories are created right before rendering into them
+            if root != top and not os.listdir(root) and os.path.getmtime(root) <= threshold:
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
+
+
+class RetentionService(object):
+    """Retention Service Class"""
+
+    @staticmethod
+    def collect_plots(keep=PLOT_RETENTION_KEEP, max_age_hours=PLOT_RETENTION_MAX_AGE_HOURS,
+                      max_bytes=PLOT_RETENTION_MAX_BYTES, orphan_minutes=PLOT_RETENTION_ORPHAN_MINUTES,
+                      batch_size=PLOT_RETENTION_BATCH_SIZE):
+        """Remove plots and plot files the retention policy no longer keeps. keep is at least 1, and 0 disables
+        max_age_hours and max_bytes. Returns a RetentionReport"""
+
+        logging.info('[RETENTION]: Collecting plots')
+
+        keep = max(int(keep), 1)
+        cutoff = datetime.utcnow() - timedelta(hours=max_age_hours) if max_age_hours else None
+
+        report = RetentionReport()
+
+        logging.info('[DB]: QUERY')
+        delete_storm_plots(expired_storm_plots(keep, cutoff), batch_size, report)
+        delete_summary_plots(expired_summary_plots(keep, cutoff), batch_size, report)
+
+        if max_bytes:
+            storm_rows, summary_ids = oldest_plots_over(max_bytes)
+
+            delete_storm_plots(storm_rows, batch_size, report)
+            delete_summary_plots(summary_ids, batch_size, report)
+
+        # cached realtime responses list the plots of each storm
+        if report.storm_ids:
+            refresh_realtime_storms(report.storm_ids)
+
+        remove_orphan_files(orphan_minutes * 60, report)
+
+        logging.info(f'[RETENTION]: Removed {report.storm_plots} storm plots, {report.summary_plots} summary plots '
+                     f'and {report.files + report.orphans} files ({report.orphans} orphaned), reclaiming '
+                     f'{report.bytes / 1024 / 1024:.1f} MB')
+
+        return report
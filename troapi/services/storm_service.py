@@ -1,44 +1,37 @@
 """Storm SERVICE """
 
+import base64
+import hashlib
 import logging
+import math
 import os
-import shutil
-import tempfile
-from datetime import datetime
-
-from sqlalchemy import desc
-from tropycal import realtime
-from tropycal.realtime import RealtimeStorm
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from itertools import product
+
+import numpy as np
+from sqlalchemy import tuple_
+from sqlalchemy.orm import load_only, selectinload
 from werkzeug.utils import secure_filename
 
 from troapi import app, db
-from troapi.errors import StormNotFound, StormHasNoForecast
+from troapi.errors import StormNotFound, StormHasNoForecast, StormPlotError
+from troapi.fetcher import fetcher
+from troapi.helpers import file_lock, transaction
 from troapi.models import Storm, StormForecast, Plot, PlotFile, StormPlot
+from troapi.models.storm import TRACK_COLUMNS, TRACK_FORMATS, get_fingerprint, track_extent
+from troapi.renderer import PlotJob, on_demand_renderer, renderer
+from troapi.services.cache_service import CacheService, CACHED_TRACK_THINNING, REALTIME_STORMS_KEY, decode, \
+    get_realtime_storms_key, get_storm_key
+from troapi.services.tile_service import TileService
+from troapi.snapshot import snapshots
+from troapi.utils import haversine_km, to_native_list
 
 UPLOAD_FOLDER = app.config['UPLOAD_FOLDER']
 
-
-def clean_up_storm_plots(storm_id):
-    db_storm = None
-
-    try:
-        db_storm = StormService.get_storm(storm_id)
-    except Exception:
-        pass
-
-    if db_storm:
-        for plot in db_storm.plot:
-            try:
-                db.session.delete(plot)
-                # delete plot from disk
-                os.remove(os.path.join(UPLOAD_FOLDER, plot.file_path))
-
-                logging.info(f"Deleted plot {plot.plot_type} for storm {db_storm.id}")
-            except Exception as e:
-                logging.error(f"Error deleting plot {plot.id}, {e}")
-
-        # remove storm plot directory
-        shutil.rmtree(os.path.join(UPLOAD_FOLDER, f"storm_plots/{db_storm.id}"), ignore_errors=True)
+# what an ingestion worker prepared for one storm, written to the database by the ingestion thread
+StormUpdate = namedtuple("StormUpdate", ["storm_id", "data", "forecast", "plots"])
 
 
 def get_realtime_storm_data(storm, realtime_obj):
@@ -56,273 +49,525 @@ def get_realtime_storm_data(storm, realtime_obj):
     other_info["update_time"] = realtime_obj.time
     other_info["jtwc_source"] = realtime_obj.jtwc_source
 
-    data = {**storm_vars, **storm.attrs, **other_info, }
+    # peak intensity and bounding box, for archive queries
+    extent = track_extent(storm_vars.get("lat", []), storm_vars.get("lon", []), storm_vars.get("vmax", []),
+                          storm_vars.get("mslp", []))
+
+    data = {**storm_vars, **storm.attrs, **other_info, **extent, }
 
     return data
 
 
-def get_realtime_storm_forecast(storm):
-    try:
-        forecast_data = storm.get_forecast_realtime(ssl_certificate=False)
-        data = {**forecast_data}
-        return data
-    except Exception as e:
-        return None
+def same_value(stored, incoming):
+    """Compare a stored value with an incoming one. NaN equals NaN, and dict keys are compared as strings,
+    as JSON columns return them"""
 
+    if isinstance(stored, list) and isinstance(incoming, list):
+        return len(stored) == len(incoming) and all(same_value(a, b) for a, b in zip(stored, incoming))
 
-def create_or_update_storm_forecast(realtime_storm, db_storm):
-    if not realtime_storm.invest:
+    if isinstance(stored, dict) and isinstance(incoming, dict):
+        stored = {str(key): value for key, value in stored.items()}
+        incoming = {str(key): value for key, value in incoming.items()}
+        return stored.keys() == incoming.keys() and all(same_value(stored[key], incoming[key]) for key in stored)
 
-        forecast_data = get_realtime_storm_forecast(realtime_storm)
+    if isinstance(stored, float) and isinstance(incoming, float) and math.isnan(stored) and math.isnan(incoming):
+        return True
 
-        if forecast_data:
+    return stored == incoming
 
-            existing_storm_forecast = StormForecast.query.filter_by(storm_id=db_storm.id).first()
 
-            if existing_storm_forecast:
-                try:
-                    for key in forecast_data:
-                        if hasattr(existing_storm_forecast, key):
-                            setattr(existing_storm_forecast, key, forecast_data[key])
-                    # update
-                    logging.info('[DB]: UPDATE STORM FORECAST')
-                    db.session.commit()
+def apply_changes(db_obj, data, ignore=()):
+    """Set only the columns whose incoming value differs from the stored one. Track arrays that only gained new
+    points are appended to. Returns the names of the changed columns"""
 
-                    logging.info(f"Updated Storm Forecast: {db_storm.id} ")
-                except Exception as e:
-                    print(e)
-                    db.session.rollback()
-            else:
-                db_storm_forecast = StormForecast(**forecast_data, storm_id=db_storm.id)
+    columns = db_obj.__table__.columns
+    changed = []
 
-                try:
-                    logging.info('[DB]: ADD STORM FORECAST')
-                    db.session.add(db_storm_forecast)
-                    db.session.commit()
-                    logging.info(f"Created Storm Forecast for: {db_storm.id} ")
-                except Exception as e:
-                    print(e)
-                    db.session.rollback()
+    for key, value in data.items():
+        if key not in columns or key in ignore:
+            continue
 
+        stored = getattr(db_obj, key)
 
-def create_storm_plots(realtime_storm, db_storm, update_time):
-    def get_file_path(storm_id, plot_type, dt):
-        date_path = f"storm_plots/{storm_id}/{dt.strftime('%Y%m%d')}/{dt.strftime('%H')}"
+        if same_value(stored, value):
+            continue
 
-        # make dir recursively, dont raise if exists
-        os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], date_path), exist_ok=True)
+        if isinstance(stored, list) and isinstance(value, list) and len(stored) < len(value) \
+                and same_value(list(stored), value[:len(stored)]):
+            # new track points were appended
+            stored.extend(value[len(stored):])
+        else:
+            setattr(db_obj, key, value)
 
-        fn = dt.strftime("%Y_%m_%d-%H_%M_%S")
+        changed.append(key)
 
-        file_path = os.path.join(date_path, f"{plot_type}_{secure_filename(fn)}.png")
+    return changed
 
-        return file_path
 
-    def create_plot(plot_type):
+def apply_storm_changes(db_storm, data):
+    """Apply incoming storm data. The update time only moves when the storm data itself changed"""
 
-        file_path = None
+    changed = apply_changes(db_storm, data, ignore=("update_time", "jtwc_source"))
 
-        if plot_type == "observed_track":
-            file_path = get_file_path(db_storm.id, plot_type, update_time)
+    if changed:
+        apply_changes(db_storm, data)
 
-            try:
-                realtime_storm.plot(save_path=os.path.join(app.config['UPLOAD_FOLDER'], file_path))
-            except Exception as e:
-                logging.info(f"[PLOTTING]: Error plotting {plot_type} for storm {db_storm.id}: {e}")
-                return
+    return changed
 
-        if plot_type == "latest_forecast":
-            file_path = get_file_path(db_storm.id, plot_type, update_time)
-            temp_dir = tempfile.mkdtemp()
-            try:
-                realtime_storm.plot_forecast_realtime(save_path=temp_dir, ssl_certificate=False)
 
-                for filename in os.listdir(temp_dir):
-                    f = os.path.join(temp_dir, filename)
+def get_storm_forecast_data(forecast):
+    return {key: to_native_list(value) if isinstance(value, list) else value for key, value in forecast.items()}
 
-                    if f.endswith("_track.png"):
-                        # move temp file to file_path
-                        shutil.move(f, os.path.join(app.config['UPLOAD_FOLDER'], file_path))
-                        shutil.rmtree(temp_dir, ignore_errors=True)
-                    break
 
-            except Exception as e:
-                logging.info(f"[PLOTTING]: Error plotting {plot_type} for storm {db_storm.id}: {e}")
-                shutil.rmtree(temp_dir, ignore_errors=True)
-                return
+def upsert_storm_forecast(db_storm, forecast_data):
+    """Create or update the forecast of a storm, in the current transaction"""
 
-        if plot_type == "forecast_model_tracks":
-            file_path = get_file_path(db_storm.id, plot_type, update_time)
+    if db_storm.forecast:
+        changed = apply_changes(db_storm.forecast, forecast_data)
 
-            try:
-                realtime_storm.plot_models(save_path=os.path.join(app.config['UPLOAD_FOLDER'], file_path))
-            except Exception as e:
-                logging.info(f"[PLOTTING]: Error plotting {plot_type} for storm {db_storm.id}: {e}")
-                return
+        if changed:
+            logging.info('[DB]: UPDATE STORM FORECAST')
+            logging.info(f"Updated Storm Forecast: {db_storm.id} ({', '.join(changed)})")
+        else:
+            logging.info(f"Storm Forecast unchanged: {db_storm.id} ")
+    else:
+        logging.info('[DB]: ADD STORM FORECAST')
+        db_storm.forecast = StormForecast(**forecast_data, storm_id=db_storm.id)
+        logging.info(f"Created Storm Forecast for: {db_storm.id} ")
 
-        if plot_type == "forecast_gefs_density":
-            file_path = get_file_path(db_storm.id, plot_type, update_time)
 
-            try:
-                realtime_storm.plot_ensembles(save_path=os.path.join(app.config['UPLOAD_FOLDER'], file_path))
-            except Exception as e:
-                logging.info(f"[PLOTTING]: Error plotting {plot_type} for storm {db_storm.id}: {e}")
-                return
+def upsert_storm(db_storm, update):
+    """Create or update a storm and its forecast, in the current transaction"""
 
-        if plot_type == "forecast_gefs_tracks":
-            pass
+    if db_storm:
+        # only assign values that differ from the stored ones
+        changed = apply_storm_changes(db_storm, update.data)
 
-        if file_path:
-            try:
-                data = {
-                    "storm_id": db_storm.id,
-                    "updated_on": update_time,
-                    "plot_type": plot_type,
-                    "file_path": file_path
-                }
-
-                storm_plot = StormPlot(**data)
-
-                logging.info('[DB]: SAVE PLOT')
-                db.session.add(storm_plot)
-                db.session.commit()
-                logging.info(f"Created {plot_type} plot for storm: {db_storm.id}")
-            except Exception as e:
-                logging.error(f"[PLOTTING]: Error saving plot {plot_type} for storm {db_storm.id} to db, {e}")
-                db.session.rollback()
+        if changed:
+            logging.info('[DB]: UPDATE STORM')
+            logging.info(f"Updated Storm: {db_storm.id} ({', '.join(changed)})")
+        else:
+            logging.info(f"Storm unchanged: {db_storm.id} ")
+    else:
+        logging.info('[DB]: CREATE STORM')
+        db_storm = Storm(**update.data)
+        db.session.add(db_storm)
+        logging.info(f"Created storm: {db_storm.id} ")
 
-    # get the latest created plot
-    latest_storm_plot = StormPlot.query.filter_by(storm_id=db_storm.id).order_by(desc(StormPlot.updated_on)).first()
+    if update.forecast:
+        upsert_storm_forecast(db_storm, update.forecast)
 
-    can_create_plots = False
+    return db_storm
 
-    if latest_storm_plot:
-        logging.info(f"Latest plot found was updated on: {latest_storm_plot.updated_on.isoformat()}")
-        elapsed = update_time - latest_storm_plot.updated_on
 
-        seconds_to_exceed = 30 * 60
+def get_storm_plot_file_path(storm_id, plot_type, dt):
+    date_path = f"storm_plots/{storm_id}/{dt.strftime('%Y%m%d')}/{dt.strftime('%H')}"
 
-        # get time passed since last update
-        # we update plots if only 30 minutes have passed since the last update.
-        # This is implemented to save on disk space
-        if elapsed.total_seconds() >= seconds_to_exceed:
-            can_create_plots = True
-        else:
-            logging.info(
-                f"Not creating new plots for storm {db_storm.id} as elapsed time ({elapsed.total_seconds()}s) "
-                f"is less than defined time ({seconds_to_exceed}s)")
+    # make dir recursively, dont raise if exists
+    os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], date_path), exist_ok=True)
 
-    else:
-        # no storm plots found, allow creating new
-        can_create_plots = True
+    fn = dt.strftime("%Y_%m_%d-%H_%M_%S")
 
-    if can_create_plots:
-        # create plots
-        create_plot("observed_track")
-        create_plot("forecast_model_tracks")
-        create_plot("forecast_gefs_density")
-        create_plot("forecast_gefs_tracks")
+    file_path = os.path.join(date_path, f"{plot_type}_{secure_filename(fn)}.png")
 
-        if not realtime_storm.invest:
-            create_plot("latest_forecast")
+    return file_path
 
 
-def update_storm(db_storm, realtime_storm, realtime_obj):
-    try:
-        data = get_realtime_storm_data(realtime_storm, realtime_obj)
-        for key in data:
-            if hasattr(db_storm, key):
-                setattr(db_storm, key, data[key])
-        # update
-        logging.info('[DB]: UPDATE STORM')
-        db.session.commit()
+def get_summary_plot_file_path(basin, dt):
+    date_path = f"summary_plots/{dt.strftime('%Y%m%d')}/{dt.strftime('%H')}"
 
-        logging.info(f"Updated Storm: {db_storm.id} ")
-    except Exception as e:
-        db.session.rollback()
-        print(e)
+    # make dir recursively, dont raise if exists
+    os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], date_path), exist_ok=True)
 
-    if not realtime_storm.invest:
-        create_or_update_storm_forecast(realtime_storm, db_storm)
+    fn = dt.strftime("%Y_%m_%d-%H_%M_%S")
 
+    file_path = os.path.join(date_path, f"{basin}_{secure_filename(fn)}.png")
 
-def create_or_update_storm(storm_id, realtime_obj):
-    realtime_storm = realtime_obj.get_storm(storm_id)
+    return file_path
 
-    data = get_realtime_storm_data(realtime_storm, realtime_obj)
 
+def save_storm_plot(db_storm, plot_type, file_path, update_time, fingerprint, variants=None):
     try:
-        db_storm = StormService.get_storm(storm_id)
+        data = {
+            "storm_id": db_storm.id,
+            "updated_on": update_time,
+            "plot_type": plot_type,
+            "file_path": file_path,
+            "fingerprint": fingerprint,
+            "variants": variants
+        }
+
+        storm_plot = StormPlot(**data)
+
+        logging.info('[DB]: SAVE PLOT')
+        db.session.add(storm_plot)
+        db.session.commit()
+        logging.info(f"Created {plot_type} plot for storm: {db_storm.id}")
     except Exception as e:
+        logging.error(f"[PLOTTING]: Error saving plot {plot_type} for storm {db_storm.id} to db, {e}")
         db.session.rollback()
-        db_storm = None
+        return
 
-    # update storm already in database
-    if db_storm:
-        # loop all data keys, check if key is in db_storm, and assign new value
-        for key in data:
-            if hasattr(db_storm, key):
-                setattr(db_storm, key, data[key])
-        # update
+    # cached realtime responses list the plots of each storm
+    if db_storm.realtime:
         try:
-            logging.info('[DB]: UPDATE STORM')
-            db.session.commit()
-            logging.info(f"Updated Storm: {db_storm.id} ")
+            refresh_realtime_storms([db_storm.id])
+        except Exception as e:
+            logging.error(f"[SERVICE]: Error caching realtime storm responses, {e}")
 
-            # update storm forecast
-            if not realtime_storm.invest:
-                create_or_update_storm_forecast(realtime_storm, db_storm)
 
-            # create storm plots
-            create_storm_plots(realtime_storm, db_storm, realtime_obj.time)
+def get_storm_plot(storm_id, plot_type, fingerprint):
+    """Latest plot of a type rendered from the given storm data, if its file is still on disk"""
 
-        except Exception as e:
-            logging.error(f"[DB]: Error creating updating storm {e}")
-            db.session.rollback()
-    else:
-        # create new storm
-        db_storm = Storm(**data)
+    storm_plot = StormPlot.query.filter_by(storm_id=storm_id, plot_type=plot_type, fingerprint=fingerprint) \
+        .order_by(StormPlot.updated_on.desc()).first()
 
-        try:
-            logging.info('[DB]: CREATE STORM')
-            db.session.add(db_storm)
-            db.session.commit()
-            logging.info(f"Created storm: {db_storm.id} ")
-        except Exception as e:
-            logging.error(f"[DB]: Error creating storm {e}")
-            db.session.rollback()
+    if storm_plot and os.path.isfile(os.path.join(UPLOAD_FOLDER, storm_plot.file_path)):
+        return storm_plot
+
+    return None
+
+
+def render_storm_plots(realtime_storm, forecast, update_time, fingerprint, latest_fingerprints):
+    """Render the plots of a storm whose data changed since they were last rendered. Returns the StormPlot rows to
+    insert for them"""
+
+    storm_id = realtime_storm.id
+
+    plot_types = ["observed_track", "forecast_model_tracks", "forecast_gefs_density"]
+
+    # without a forecast tropycal would fetch it itself, inside the render, with no timeout
+    if not realtime_storm.invest and forecast:
+        plot_types.append("latest_forecast")
+    elif not realtime_storm.invest:
+        logging.info(f"Not creating latest_forecast plot for storm {storm_id} as it has no forecast")
+
+    # only render plots whose track or forecast changed since they were last rendered
+    stale_plot_types = []
+    for plot_type in plot_types:
+        if latest_fingerprints.get(plot_type) == fingerprint:
+            logging.info(f"Not creating new {plot_type} plot for storm {storm_id} as its data has not changed")
+            continue
+
+        stale_plot_types.append(plot_type)
+
+    # forecast plots reuse the forecast fetched for this cycle
+    jobs = [PlotJob(storm_id, plot_type, realtime_storm.dict,
+                    get_storm_plot_file_path(storm_id, plot_type, update_time), forecast)
+            for plot_type in stale_plot_types]
+
+    storm_plots = []
+
+    # render in the plot worker processes
+    for result in renderer.render(jobs):
+        if result.error:
+            logging.info(f"[PLOTTING]: Error plotting {result.plot_type} for storm {storm_id}: {result.error}")
+            continue
+
+        storm_plots.append({
+            "storm_id": storm_id,
+            "updated_on": update_time,
+            "plot_type": result.plot_type,
+            "file_path": result.file_path,
+            "fingerprint": fingerprint,
+            "variants": result.variants
+        })
+
+    return storm_plots
+
+
+def prepare_storm_update(realtime_storm, forecast, realtime_obj, stored_forecast, latest_fingerprints):
+    """Render the plots of an incoming storm, with its already fetched forecast. Runs on an ingestion worker thread
+    and does not touch the database"""
+
+    data = get_realtime_storm_data(realtime_storm, realtime_obj)
+
+    forecast_data = get_storm_forecast_data(forecast) if forecast else None
+
+    # a forecast that could not be fetched this time stays as stored, and is plotted as stored
+    if forecast is None:
+        forecast = stored_forecast
+
+    forecast_init = forecast["init"] if forecast else None
+
+    fingerprint = get_fingerprint(data["date"], data["lat"], data["lon"], data["vmax"], data["mslp"], forecast_init)
+
+    plots = render_storm_plots(realtime_storm, forecast, realtime_obj.time, fingerprint, latest_fingerprints)
+
+    return StormUpdate(realtime_storm.id, data, forecast_data, plots)
+
+
+def save_storm_updates(updates, db_storms, realtime_storm_list, update_time):
+    """Write a whole ingestion cycle in a single transaction, so readers see all of it or none of it.
+    Returns the ids of storms that are no longer realtime"""
+
+    with transaction():
+        storm_plots = []
+
+        for update in updates:
+            try:
+                # a bad storm only rolls back its own savepoint
+                with db.session.begin_nested():
+                    upsert_storm(db_storms.get(update.storm_id), update)
+            except Exception as e:
+                logging.error(f"[DB]: Error creating or updating storm {update.storm_id}, {e}")
+                continue
+
+            storm_plots.extend(update.plots)
+
+        if storm_plots:
+            logging.info(f'[DB]: SAVE {len(storm_plots)} PLOTS')
+            db.session.bulk_insert_mappings(StormPlot, storm_plots)
+
+        # realtime db storms not in the updated realtime list are marked as not realtime
+        stale_storm_ids = [storm_id for (storm_id,) in
+                           db.session.query(Storm.id).filter(Storm.realtime.is_(True),
+                                                             Storm.id.notin_(realtime_storm_list))]
+
+        if stale_storm_ids:
+            logging.info(f"DB Storms {', '.join(stale_storm_ids)} not found in incoming realtime storms. "
+                         f"Mark as not realtime")
+
+            # their plots are left to the retention job
+            Storm.query.filter(Storm.id.in_(stale_storm_ids)) \
+                .update({"realtime": False, "update_time": update_time}, synchronize_session=False)
+
+    return stale_storm_ids
+
+
+def get_summary_fingerprints(basins):
+    """Hash of the realtime storms each summary basin shows, the 'all' domain shows every storm. Storm fingerprints
+    cover their track and forecast"""
+
+    logging.info('[DB]: QUERY')
 
-        if not realtime_storm.invest:
-            # update storm forecast
-            create_or_update_storm_forecast(realtime_storm, db_storm)
+    storms = Storm.query.options(selectinload(Storm.forecast)).filter_by(realtime=True).order_by(Storm.id).all()
 
-        create_storm_plots(realtime_storm, db_storm, realtime_obj.time)
+    fingerprints = {}
+
+    for basin in basins:
+        fingerprint = hashlib.sha256()
+
+        for storm in storms:
+            if basin == "all" or storm.basin == basin:
+                fingerprint.update(f"{storm.id}:{storm.fingerprint}".encode())
+
+        fingerprints[basin] = fingerprint.hexdigest()
+
+    return fingerprints
+
+
+def encode_cursor(storm):
+    return base64.urlsafe_b64encode(f"{storm.update_time.isoformat()}|{storm.id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Update time and id of the storm a page continues after. Raises ValueError for invalid cursors"""
+
+    update_time, storm_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+
+    return datetime.fromisoformat(update_time), storm_id
+
+
+def get_storms_query(fields=None, include=None, extra_columns=()):
+    """Storm query that only loads what serializing the fields and parts in include needs. Everything without
+    fields"""
+
+    if fields is None:
+        # load forecasts and plots of all storms in one query each, instead of one per storm when serializing
+        return Storm.query.options(selectinload(Storm.forecast), selectinload(Storm.plot))
+
+    include = include if include else []
+
+    # keyset pagination orders by update time and id
+    columns = {"id", "update_time", *fields, *extra_columns}
+    options = []
+
+    if "track" in include:
+        columns.update(TRACK_COLUMNS)
+        options.append(selectinload(Storm.forecast))
+
+    if "plots" in include:
+        options.append(selectinload(Storm.plot))
+
+    return Storm.query.options(load_only(*[getattr(Storm, column) for column in columns]), *options)
+
+
+def cache_realtime_storms():
+    """Re-serialize the realtime storm responses the API serves, in every track format and cached thinning level,
+    and drop those of storms no longer realtime"""
+
+    logging.info('[SERVICE]: Caching realtime storm responses')
+
+    storms = StormService.get_realtime_storms()
+
+    payloads = {}
+
+    for track_format, (simplify, step) in product(TRACK_FORMATS, CACHED_TRACK_THINNING):
+        data = [storm.serialize(track_format=track_format, simplify=simplify, step=step) for storm in storms]
+
+        payloads[get_realtime_storms_key(track_format, simplify, step)] = {
+            "data": data,
+            "count": len(data)
+        }
+
+        for storm, serialized in zip(storms, data):
+            payloads[get_storm_key(storm.id, track_format, simplify, step)] = serialized
+
+    CacheService.set_many(payloads, prefix=REALTIME_STORMS_KEY)
+
+    logging.info(f'[SERVICE]: Cached responses for {len(storms)} realtime storms')
+
+
+def refresh_realtime_storms(storm_ids):
+    """Re-serialize the cached responses of some realtime storms, after their plots changed outside ingestion. The
+    cached lists are patched with them instead of serializing every storm, and responses a concurrent ingestion
+    rewrote in the meantime are left as they are"""
+
+    logging.info(f"[SERVICE]: Refreshing cached responses of storms {', '.join(storm_ids)}")
+
+    storms = get_storms_query().filter(Storm.realtime.is_(True), Storm.id.in_(list(storm_ids))).all()
+
+    if not storms:
+        return
+
+    payloads = {}
+    lists = {}
+
+    for track_format, (simplify, step) in product(TRACK_FORMATS, CACHED_TRACK_THINNING):
+        serialized = {storm.id: storm.serialize(track_format=track_format, simplify=simplify, step=step)
+                      for storm in storms}
+
+        for storm_id, data in serialized.items():
+            payloads[get_storm_key(storm_id, track_format, simplify, step)] = data
+
+        lists[get_realtime_storms_key(track_format, simplify, step)] = serialized
+
+    cached = CacheService.get_many(list(payloads) + list(lists))
+
+    for key, serialized in lists.items():
+        if key in cached:
+            listing = decode(cached[key].body)
+            listing["data"] = [serialized.get(data["id"], data) for data in listing["data"]]
+            payloads[key] = listing
+
+    # keys not cached yet are left to the next ingestion cycle
+    replaced = CacheService.replace_many({key: (payload, cached[key].etag) for key, payload in payloads.items()
+                                          if key in cached})
+
+    logging.info(f"[SERVICE]: Refreshed {replaced} cached responses")
 
 
 class StormService(object):
     """Storm Service Class"""
 
     @staticmethod
-    def get_storms(page=1):
+    def get_storms(cursor=None, fields=None, include=None, basin=None, season=None, start=None, end=None,
+                   min_wind=None, max_pressure=None, bbox=None, near=None, radius=None):
+        """A page of storms matching archive filters, most recently updated first, and the cursor of the next page.
+        bbox is (min_lon, min_lat, max_lon, max_lat), near is (lat, lon) and radius is in km"""
+
         logging.info('[SERVICE]: Getting storms')
         logging.info('[DB]: QUERY')
 
         per_page = app.config['ITEMS_PER_PAGE']
-        query = Storm.query
 
-        return query.paginate(page=page, per_page=per_page)
+        spatial_fallback = (bbox or near) and db.engine.dialect.name != "postgresql"
+
+        # the fallback checks track points itself
+        query = get_storms_query(fields, include, extra_columns=("lat", "lon") if spatial_fallback else ())
+
+        if basin:
+            query = query.filter(Storm.basin == basin)
+        if season:
+            query = query.filter(Storm.season == season)
+
+        # storms active at any time in the range
+        if start:
+            query = query.filter(Storm.end_date >= start)
+        if end:
+            query = query.filter(Storm.start_date <= end)
+
+        if min_wind is not None:
+            query = query.filter(Storm.max_wind >= min_wind)
+        if max_pressure is not None:
+            query = query.filter(Storm.min_pressure <= max_pressure)
+
+        # keyset pagination, a page starts right after the last storm of the previous one
+        if cursor:
+            update_time, storm_id = decode_cursor(cursor)
+            query = query.filter(tuple_(Storm.update_time, Storm.id) < tuple_(update_time, storm_id))
+
+        query = query.order_by(Storm.update_time.desc(), Storm.id.desc())
+
+        if bbox and not spatial_fallback:
+            # answered from the GiST index on the track geography
+            query = query.filter(db.text(
+                "ST_Intersects(storm.track, ST_MakeEnvelope(:min_lon, :min_lat, :max_lon, :max_lat, 4326)"
+                "::geography)").bindparams(min_lon=bbox[0], min_lat=bbox[1], max_lon=bbox[2], max_lat=bbox[3]))
+        if near and not spatial_fallback:
+            query = query.filter(db.text(
+                "ST_DWithin(storm.track, ST_SetSRID(ST_MakePoint(:near_lon, :near_lat), 4326)::geography, "
+                ":distance)").bindparams(near_lat=near[0], near_lon=near[1], distance=radius * 1000))
+
+        if not spatial_fallback:
+            # one more than a page tells whether there is a next one
+            storms = query.limit(per_page + 1).all()
+        else:
+            # without PostGIS, narrow down on the stored track extent, then check the track points
+            if bbox:
+                query = query.filter(Storm.max_lon >= bbox[0], Storm.max_lat >= bbox[1], Storm.min_lon <= bbox[2],
+                                     Storm.min_lat <= bbox[3])
+            if near:
+                degrees = radius / 111.2
+                query = query.filter(Storm.max_lat >= near[0] - degrees, Storm.min_lat <= near[0] + degrees)
+
+            storms = []
+            for storm in query.yield_per(per_page):
+                lat, lon = np.asarray(storm.lat, dtype=float), np.asarray(storm.lon, dtype=float)
+
+                if bbox and not ((lon >= bbox[0]) & (lat >= bbox[1]) & (lon <= bbox[2]) & (lat <= bbox[3])).any():
+                    continue
+                if near and not (haversine_km(near[0], near[1], lat, lon) <= radius).any():
+                    continue
+
+                storms.append(storm)
+
+                if len(storms) > per_page:
+                    break
+
+        next_cursor = encode_cursor(storms[per_page - 1]) if len(storms) > per_page else None
+
+        return storms[:per_page], next_cursor
 
     @staticmethod
-    def get_realtime_storms():
+    def get_realtime_storms(fields=None, include=None):
         logging.info('[SERVICE]: Getting all realtime storms')
         logging.info('[DB]: QUERY')
 
-        storms = Storm.query.filter_by(realtime=True).all()
+        storms = get_storms_query(fields, include).filter_by(realtime=True).all()
 
         logging.info(f'[SERVICE]: Fetched {len(storms)} realtime storms from DB')
 
         return storms
 
+    @staticmethod
+    def iter_realtime_storms(batch_size=None):
+        """Realtime storms, read from a server side cursor a batch at a time, so memory stays flat regardless of
+        the number of storms"""
+
+        logging.info('[SERVICE]: Streaming realtime storms')
+        logging.info('[DB]: QUERY')
+
+        batch_size = batch_size or app.config['STREAM_BATCH_SIZE']
+
+        # forecasts and plots are loaded per batch
+        query = Storm.query.options(selectinload(Storm.forecast), selectinload(Storm.plot)) \
+            .filter_by(realtime=True).order_by(Storm.id).yield_per(batch_size)
+
+        for storm in query:
+            yield storm
+
     @staticmethod
     def get_storm(storm_id):
         logging.info(f"[SERVICE]: Getting storm {storm_id} ")
@@ -340,6 +585,8 @@ class StormService(object):
 
     @staticmethod
     def plot_storm(storm_id, forecast=False):
+        """Path of the storm plot for the storm's current data, rendered at most once per data version"""
+
         logging.info(f"[SERVICE]: Getting storm {storm_id} ")
         logging.info('[DB]: QUERY')
 
@@ -351,72 +598,110 @@ class StormService(object):
         if not storm:
             raise StormNotFound(message=f"Storm with id {storm_id} does not exist")
 
-        storm_data = storm.storm_object
-
         if forecast and storm.invest:
             raise StormHasNoForecast(message="Storm is invest and has no forecast")
 
-        realtime_storm = RealtimeStorm(storm_data)
+        if forecast and not storm.forecast:
+            raise StormHasNoForecast(message="Storm has no forecast yet")
 
-        tmp_plot_file = tempfile.NamedTemporaryFile(mode='w+b', suffix=".png")
+        plot_type = "latest_forecast" if forecast else "observed_track"
+        fingerprint = storm.fingerprint
 
-        if not forecast:
-            realtime_storm.plot(save_path=tmp_plot_file.name)
-            return tmp_plot_file
-        else:
-            temp_dir = tempfile.mkdtemp()
+        storm_plot = get_storm_plot(storm.id, plot_type, fingerprint)
+
+        if storm_plot:
+            return os.path.join(UPLOAD_FOLDER, storm_plot.file_path)
+
+        # concurrent misses for the same plot wait here for a single render. The lock is a file lock, so this only
+        # holds across the web workers of one host. Replicas sharing an upload folder may each render the plot once
+        with file_lock(f"storm_plot_{storm.id}_{plot_type}_{fingerprint}"):
+            storm_plot = get_storm_plot(storm.id, plot_type, fingerprint)
+
+            if storm_plot:
+                return os.path.join(UPLOAD_FOLDER, storm_plot.file_path)
+
+            logging.info(f"[PLOTTING]: Rendering {plot_type} plot for storm {storm.id} on demand")
+
+            # plain lists for the worker process
+            storm_data = {key: list(value) if isinstance(value, list) else value for key, value in
+                          storm.storm_object.items()}
+
+            # the stored forecast is the one the fingerprint covers, tropycal would fetch a newer one
+            forecast_data = storm.forecast.forecast_object if storm.forecast else None
+
+            file_path = get_storm_plot_file_path(storm.id, plot_type, storm.update_time)
 
-            realtime_storm.plot_forecast_realtime(save_path=temp_dir, ssl_certificate=False)
+            result = on_demand_renderer.render([PlotJob(storm.id, plot_type, storm_data, file_path, forecast_data)])[0]
 
-            for filename in os.listdir(temp_dir):
-                f = os.path.join(temp_dir, filename)
+            if result.error:
+                raise StormPlotError(message=f"Error plotting {plot_type} for storm {storm.id}: {result.error}")
 
-                if f.endswith("_track.png"):
-                    # move to temp file
-                    shutil.move(f, tmp_plot_file.name)
-                    os.rmdir(temp_dir)
-                break
+            save_storm_plot(storm, plot_type, result.file_path, storm.update_time, fingerprint, result.variants)
 
-        return tmp_plot_file
+        return os.path.join(UPLOAD_FOLDER, result.file_path)
 
     @staticmethod
     def update_storms(jtwc_source="jtwc"):
         logging.info(f"[SERVICE]: Updating storms")
 
         try:
-            # create realtime object
-            realtime_obj = realtime.Realtime(jtwc=True, jtwc_source=jtwc_source, ssl_certificate=False)
+            # each ingestion cycle starts from fresh upstream data, later jobs of the cycle reuse it
+            snapshot = snapshots.get(jtwc_source, refresh=True)
+            realtime_obj = snapshot.realtime
 
             # get list of active storms
-            realtime_storm_list = realtime_obj.list_active_storms()
+            realtime_storm_list = snapshot.storm_ids
 
-            # get all existing realtime storms from database
-            db_realtime_storms = StormService.get_realtime_storms()
+            # stored state incoming storms are compared against, read once for the whole cycle
+            db_storms = {storm.id: storm for storm in Storm.query.options(selectinload(Storm.forecast),
+                                                                          selectinload(Storm.plot))
+                         .filter(Storm.id.in_(realtime_storm_list))}
 
-            for db_storm in db_realtime_storms:
-                if db_storm.id not in realtime_storm_list:
-                    # realtime db storm not in updated realtime list, proceed to mark as not realtime
-                    updated = False
+            stored_forecasts = {storm_id: db_storm.forecast.forecast_object for storm_id, db_storm in db_storms.items()
+                                if db_storm.forecast}
 
+            latest_fingerprints = {}
+            for storm_id, db_storm in db_storms.items():
+                # newest plot of each type wins
+                for storm_plot in sorted(db_storm.plot, key=lambda p: p.updated_on):
+                    latest_fingerprints.setdefault(storm_id, {})[storm_plot.plot_type] = storm_plot.fingerprint
+
+            realtime_storms = list(snapshot.storms.values())
+
+            # fetch the forecasts of all storms concurrently, once for the whole cycle
+            forecasts = fetcher.fetch([realtime_storm for realtime_storm in realtime_storms
+                                       if not realtime_storm.invest])
+
+            # render plots of incoming storms, a bounded number at a time.
+            # workers don't touch the database, everything is written below in a single transaction
+            workers = app.config['STORMS_UPDATE_WORKERS']
+            updates = []
+
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="storm-update") as executor:
+                futures = {}
+
+                for realtime_storm in realtime_storms:
+                    storm_id = realtime_storm.id
+                    logging.info(f"Preparing update for storm: {storm_id}")
+                    future = executor.submit(prepare_storm_update, realtime_storm, forecasts.get(storm_id),
+                                             realtime_obj, stored_forecasts.get(storm_id),
+                                             latest_fingerprints.get(storm_id, {}))
+                    futures[future] = storm_id
+
+                for future in as_completed(futures):
                     try:
-                        logging.info(
-                            f"DB Storm {db_storm.id} not found in incoming realtime storms.Mark as not realtime")
-                        db_storm.realtime = False
-                        db_storm.update_time = realtime_obj.time
-                        db.session.commit()
-                        updated = True
+                        updates.append(future.result())
+                        logging.info(f"Done preparing update for storm: {futures[future]}")
                     except Exception as e:
-                        db.session.rollback()
-                        logging.error(f"Error marking DB storm {db_storm.id} as not realtime, {e}")
+                        logging.error(f"Error preparing update for storm {futures[future]}, {e}")
+
+            save_storm_updates(updates, db_storms, realtime_storm_list, realtime_obj.time)
 
-                    if updated:
-                        # clean up plots for storms that are no longer realtime
-                        clean_up_storm_plots(db_storm.id)
+            # serve the new data from the response cache
+            cache_realtime_storms()
 
-            # create or update incoming realtime storms
-            for storm_id in realtime_storm_list:
-                logging.info(f"Creating or updating storm: {storm_id}")
-                create_or_update_storm(storm_id, realtime_obj)
+            # tiles of the previous data version are never served again
+            TileService.invalidate_tiles()
         except Exception as e:
             logging.error(f"[SERVICE]: Error updating realtime data {e}")
 
@@ -424,65 +709,98 @@ class StormService(object):
     def plot_summary(jtwc_source="jtwc"):
         logging.info(f"[SERVICE]: Ploting realtime summary")
 
-        basins = {"all"}
-
-        # create realtime object
-        realtime_obj = realtime.Realtime(jtwc=True, jtwc_source=jtwc_source, ssl_certificate=False)
+        # reuse the realtime data downloaded by this cycle's storms update
+        snapshot = snapshots.get(jtwc_source)
+        realtime_obj = snapshot.realtime
 
-        realtime_storms = realtime_obj.list_active_storms()
+        basins = snapshot.basins
 
-        for storm_id in realtime_storms:
-            storm = realtime_obj.get_storm(storm_id)
-            basins.add(storm.attrs.get("basin"))
+        fingerprints = get_summary_fingerprints(basins)
 
-        db_plot = Plot()
+        # files of the latest summary plot, by basin
+        logging.info('[DB]: QUERY')
+        latest_plot = Plot.query.options(selectinload(Plot.files)).order_by(Plot.created_on.desc()).first()
+        latest_files = {plot_file.basin: plot_file for plot_file in latest_plot.files} if latest_plot else {}
 
-        try:
-            db.session.add(db_plot)
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-            raise
+        # basins whose storms changed, or whose plot is too old, are rendered again
+        dt = datetime.now()
+        oldest = datetime.utcnow() - timedelta(hours=float(app.config['SUMMARY_PLOT_MAX_AGE_HOURS']))
 
-            # generate plot for every basin
+        stale_basins = []
         for basin in basins:
-            try:
-                dt = datetime.now()
+            plot_file = latest_files.get(basin)
+
+            if plot_file and plot_file.fingerprint == fingerprints[basin] and plot_file.updated_on and \
+                    plot_file.updated_on >= oldest:
+                continue
+
+            stale_basins.append(basin)
+
+        if not stale_basins and set(basins) == set(latest_files):
+            logging.info("[PLOTTING]: Summary plots are up to date")
+            return
 
-                date_path = f"summary_plots/{dt.strftime('%Y%m%d')}/{dt.strftime('%H')}"
+        # render the stale basins in parallel, in the plot worker processes
+        jobs = [PlotJob(None, "summary", {"realtime": realtime_obj, "domain": basin},
+                        get_summary_plot_file_path(basin, dt)) for basin in stale_basins]
 
-                # make dir recursively, dont raise if exists
-                os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], date_path), exist_ok=True)
+        rendered = {}
 
-                fn = dt.strftime("%Y_%m_%d-%H_%M_%S")
+        for basin, result in zip(stale_basins, renderer.render(jobs)):
+            if result.error:
+                logging.error(f"[PLOTTING]: Error plotting summary for basin {basin}: {result.error}")
+                continue
 
-                file_path = os.path.join(date_path, f"{basin}_{secure_filename(fn)}.png")
+            rendered[basin] = {
+                "basin": basin,
+                "file_path": result.file_path,
+                "variants": result.variants,
+                "fingerprint": fingerprints[basin],
+                "updated_on": datetime.utcnow()
+            }
 
-                realtime_obj.plot_summary(domain=basin, ssl_certificate=False,
-                                          save_path=os.path.join(app.config['UPLOAD_FOLDER'], file_path))
+        if stale_basins and not rendered:
+            logging.error("[PLOTTING]: No summary plots were created")
+            return
 
-                data = {
-                    "plot_id": db_plot.id,
+        plot_files = []
+
+        for basin in basins:
+            if basin in rendered:
+                plot_files.append(rendered[basin])
+            elif basin in latest_files:
+                # unchanged, or failed to render this time, carry the previous file over
+                plot_file = latest_files[basin]
+
+                plot_files.append({
                     "basin": basin,
-                    "file_path": file_path
-                }
+                    "file_path": plot_file.file_path,
+                    "variants": plot_file.variants,
+                    "fingerprint": plot_file.fingerprint,
+                    "updated_on": plot_file.updated_on
+                })
+
+        # the plot and all of its files become visible together
+        with transaction():
+            logging.info('[DB]: SAVE PLOT')
+            # to the microsecond, summaries plotted within the same second would collide
+            db_plot = Plot(id=dt.strftime("%Y%m%d%H%M%S%f"))
+            db.session.add(db_plot)
+            db.session.flush()
 
-                plot_file = PlotFile(**data)
+            db.session.bulk_insert_mappings(PlotFile, [{"plot_id": db_plot.id, **plot_file}
+                                                       for plot_file in plot_files])
 
-                logging.info('[DB]: SAVE PLOT')
-                db.session.add(plot_file)
-                db.session.commit()
-                logging.info(f"Created plot for basin: {plot_file.basin} ")
+        carried = [plot_file["basin"] for plot_file in plot_files if plot_file["basin"] not in rendered]
 
-            except Exception as e:
-                db.session.rollback()
-                print(e)
+        logging.info(f"Created summary plot {db_plot.id}, rendered basins: {', '.join(rendered) or 'none'}, "
+                     f"carried over: {', '.join(carried) or 'none'}")
 
     @staticmethod
     def get_recent_plot():
         logging.info('[SERVICE]: Getting recent plot')
         logging.info('[DB]: QUERY')
 
-        plots = Plot.query.first()
+        plots = Plot.query.order_by(Plot.created_on.desc()).first()
 
         return plots
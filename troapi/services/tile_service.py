@@ -0,0 +1,154 @@
+"""Tile SERVICE """
+
+import hashlib
+import logging
+
+from sqlalchemy.orm import selectinload
+
+from troapi import db
+from troapi.errors import TilesUnavailable
+from troapi.models import Storm
+from troapi.services.cache_service import CacheService
+
+TILES_KEY = "tiles"
+# outside of the tiles prefix, so it is never dropped with them
+TILES_VERSION_KEY = "tiles_version"
+
+# storm columns the tracks layer carries as properties
+TILE_PROPERTIES = ("name", "basin", "season", "realtime", "invest", "max_wind", "min_pressure")
+
+# tiles are EXTENT units across, and tracks are simplified to about a pixel of a 256 pixel tile
+EXTENT = 4096
+WORLD_WIDTH = 40075016.68
+
+# radius in nautical miles of the cone of uncertainty at each forecast hour, after the NHC 2-day/5-day cone
+CONE_RADII = [(0, 10), (12, 26), (24, 41), (36, 55), (48, 69), (60, 86), (72, 103), (96, 151), (120, 196)]
+
+# observed tracks from the GiST indexed track geography, forecast tracks and cones of realtime storms
+TILE_QUERY = """
+WITH bounds AS (
+    SELECT ST_TileEnvelope(:z, :x, :y) AS geom
+),
+tracks AS (
+    SELECT ST_AsMVTGeom(ST_Simplify(ST_Transform(storm.track::geometry, 3857), :tolerance), bounds.geom,
+                        :extent) AS geom,
+           storm.id, storm.name, storm.basin, storm.season, storm.realtime, storm.invest, storm.max_wind,
+           storm.min_pressure
+    FROM storm, bounds
+    WHERE storm.track && ST_Transform(bounds.geom, 4326)::geography
+),
+forecast_points AS (
+    SELECT storm_forecast.storm_id, point.idx, point.fhr,
+           ST_SetSRID(ST_MakePoint(mod((point.lon + 540)::numeric, 360) - 180, point.lat), 4326) AS geom
+    FROM storm_forecast
+    JOIN storm ON storm.id = storm_forecast.storm_id AND storm.realtime
+    CROSS JOIN unnest(storm_forecast.lon, storm_forecast.lat, storm_forecast.fhr)
+        WITH ORDINALITY AS point(lon, lat, fhr, idx)
+),
+forecast_lines AS (
+    SELECT storm_id, ST_MakeLine(geom ORDER BY idx) AS geom
+    FROM forecast_points
+    GROUP BY storm_id
+),
+forecasts AS (
+    SELECT ST_AsMVTGeom(ST_Transform(forecast_lines.geom, 3857), bounds.geom, :extent) AS geom,
+           forecast_lines.storm_id
+    FROM forecast_lines, bounds
+),
+circles AS (
+    SELECT forecast_points.storm_id, forecast_points.idx,
+           ST_Buffer(forecast_points.geom::geography, radius.nm * 1852)::geometry AS geom
+    FROM forecast_points
+    CROSS JOIN LATERAL (
+        SELECT cone_radii.nm FROM (VALUES {cone_radii}) AS cone_radii(fhr, nm)
+        WHERE cone_radii.fhr >= forecast_points.fhr ORDER BY cone_radii.fhr LIMIT 1
+    ) AS radius
+),
+cone_shapes AS (
+    SELECT a.storm_id, ST_Union(ST_ConvexHull(ST_Collect(a.geom, b.geom))) AS geom
+    FROM circles a
+    JOIN circles b ON b.storm_id = a.storm_id AND b.idx = a.idx + 1
+    GROUP BY a.storm_id
+),
+cones AS (
+    SELECT ST_AsMVTGeom(ST_Simplify(ST_Transform(cone_shapes.geom, 3857), :tolerance), bounds.geom, :extent) AS geom,
+           cone_shapes.storm_id
+    FROM cone_shapes, bounds
+)
+SELECT coalesce((SELECT ST_AsMVT(tracks, 'tracks', :extent, 'geom') FROM tracks WHERE geom IS NOT NULL), '')
+    || coalesce((SELECT ST_AsMVT(forecasts, 'forecasts', :extent, 'geom') FROM forecasts WHERE geom IS NOT NULL), '')
+    || coalesce((SELECT ST_AsMVT(cones, 'cones', :extent, 'geom') FROM cones WHERE geom IS NOT NULL), '')
+""".format(cone_radii=", ".join(f"({fhr}, {nm})" for fhr, nm in CONE_RADII))
+
+
+def compute_data_version():
+    """Version of the storm data tiles are rendered from. Covers what the layers draw: the track, forecast and tile
+    properties of realtime storms, and which storms are archived. Archived storms are only written when they leave
+    the realtime set, which moves their update time"""
+
+    logging.info('[DB]: QUERY')
+
+    version = hashlib.sha256()
+
+    for storm in Storm.query.options(selectinload(Storm.forecast)).filter(Storm.realtime.is_(True)).order_by(Storm.id):
+        version.update(repr([storm.id, storm.fingerprint] + [getattr(storm, name) for name in TILE_PROPERTIES])
+                       .encode())
+
+    archived = db.session.query(db.func.count(Storm.id), db.func.max(Storm.update_time)) \
+        .filter(Storm.realtime.isnot(True)).one()
+    version.update(repr(tuple(archived)).encode())
+
+    return version.hexdigest()[:16]
+
+
+def get_data_version():
+    """Version tiles are currently rendered at, set by invalidate_tiles"""
+
+    cached = CacheService.get(TILES_VERSION_KEY)
+
+    return cached.body.decode() if cached else TileService.invalidate_tiles()
+
+
+def get_tile_key(version, z, x, y):
+    return f"{TILES_KEY}:{version}:{z}/{x}/{y}"
+
+
+class TileService(object):
+    """Tile Service Class"""
+
+    @staticmethod
+    def get_tile(z, x, y):
+        """Mapbox vector tile of storm tracks and forecast cones, rendered once per data version"""
+
+        logging.info(f"[SERVICE]: Getting tile {z}/{x}/{y}")
+
+        if db.engine.dialect.name != "postgresql":
+            raise TilesUnavailable(message="Tiles are only available with a PostGIS database")
+
+        key = get_tile_key(get_data_version(), z, x, y)
+
+        cached = CacheService.get(key)
+
+        if cached:
+            return cached
+
+        logging.info('[DB]: QUERY')
+
+        tolerance = WORLD_WIDTH / 2 ** z / 256
+
+        tile = db.session.execute(db.text(TILE_QUERY), {"z": z, "x": x, "y": y, "tolerance": tolerance,
+                                                        "extent": EXTENT}).scalar()
+
+        return CacheService.set(key, bytes(tile or b""))
+
+    @staticmethod
+    def invalidate_tiles():
+        """Move tiles to the current data version, and drop those of older versions. Tiles are kept as long as
+        nothing they draw changed. Returns the version"""
+
+        version = compute_data_version()
+
+        CacheService.set(TILES_VERSION_KEY, version.encode())
+        CacheService.delete_prefix(f"{TILES_KEY}:", keep=f"{TILES_KEY}:{version}:")
+
+        return version
@@ -0,0 +1,90 @@
+"""Realtime SNAPSHOT
+
+Downloading the realtime storm list from upstream is the most expensive network step of a cycle. A snapshot holds
+the downloaded Realtime object and its storms, so every job of a cycle is served by a single download.
+"""
+
+import logging
+import threading
+import time
+
+from troapi.config import SETTINGS
+
+STORMS_MINUTES_UPDATE_INTERVAL = SETTINGS.get("STORMS_MINUTES_UPDATE_INTERVAL", 5)
+
+
+def download_realtime(jtwc_source):
+    # tropycal pulls in the whole plotting and science stack, only load it where it is needed
+    from tropycal import realtime
+
+    return realtime.Realtime(jtwc=True, jtwc_source=jtwc_source, ssl_certificate=False)
+
+
+class RealtimeSnapshot(object):
+    """A downloaded Realtime object and its active storms"""
+
+    def __init__(self, realtime_obj, jtwc_source):
+        self.realtime = realtime_obj
+        self.jtwc_source = jtwc_source
+        self.downloaded_at = time.monotonic()
+
+        self.storm_ids = realtime_obj.list_active_storms()
+        self.storms = {storm_id: realtime_obj.get_storm(storm_id) for storm_id in self.storm_ids}
+
+    @property
+    def time(self):
+        return self.realtime.time
+
+    @property
+    def age(self):
+        return time.monotonic() - self.downloaded_at
+
+    @property
+    def basins(self):
+        """Basins with active storms, led by the 'all' domain"""
+
+        basins = ["all"]
+
+        for storm in self.storms.values():
+            basin = storm.attrs.get("basin")
+
+            if basin not in basins:
+                basins.append(basin)
+
+        return basins
+
+
+class SnapshotCache(object):
+    """Latest realtime snapshot per JTWC source"""
+
+    def __init__(self, max_age, factory=download_realtime):
+        self.max_age = max_age
+        self.factory = factory
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def get(self, jtwc_source="jtwc", refresh=False):
+        """Latest snapshot of a source, downloaded again when it is older than max_age or a refresh is asked for"""
+
+        # concurrent callers wait for a single download
+        with self._lock:
+            snapshot = self._snapshots.get(jtwc_source)
+
+            if refresh or snapshot is None or snapshot.age > self.max_age:
+                logging.info(f"[SNAPSHOT]: Downloading realtime data from {jtwc_source}")
+
+                snapshot = RealtimeSnapshot(self.factory(jtwc_source), jtwc_source)
+                self._snapshots[jtwc_source] = snapshot
+
+                logging.info(f"[SNAPSHOT]: Downloaded {len(snapshot.storm_ids)} active storms")
+            else:
+                logging.info(f"[SNAPSHOT]: Using realtime data downloaded {int(snapshot.age)}s ago")
+
+            return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._snapshots = {}
+
+
+snapshots = SnapshotCache(max_age=int(STORMS_MINUTES_UPDATE_INTERVAL) * 60)
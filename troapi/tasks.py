@@ -1,8 +1,12 @@
+import logging
+
+from troapi.helpers import advisory_lock
 from troapi.scheduler import scheduler
-from troapi.services import StormService
+from troapi.services import StormService, RetentionService
 from troapi.config import SETTINGS
 
 STORMS_MINUTES_UPDATE_INTERVAL = SETTINGS.get("STORMS_MINUTES_UPDATE_INTERVAL", 5)
+PLOT_RETENTION_MINUTES_INTERVAL = SETTINGS.get("PLOT_RETENTION_MINUTES_INTERVAL", 60)
 
 
 @scheduler.task(
@@ -13,4 +17,30 @@ STORMS_MINUTES_UPDATE_INTERVAL = SETTINGS.get("STORMS_MINUTES_UPDATE_INTERVAL",
     coalesce=True
 )
 def update_storms():
-    StormService.update_storms()
+    # only one ingester may run at a time across all workers and hosts
+    with advisory_lock("update_storms") as acquired:
+        if not acquired:
+            logging.info("[TASKS]: Storms update already running elsewhere, skipping")
+            return
+
+        StormService.update_storms()
+
+        # summaries of the same realtime download, only basins whose storms changed are rendered again
+        StormService.plot_summary()
+
+
+@scheduler.task(
+    "interval",
+    id="collect_plots",
+    minutes=int(PLOT_RETENTION_MINUTES_INTERVAL),
+    max_instances=1,
+    coalesce=True
+)
+def collect_plots():
+    # runs next to ingestion, never inside it
+    with advisory_lock("collect_plots") as acquired:
+        if not acquired:
+            logging.info("[TASKS]: Plot retention already running elsewhere, skipping")
+            return
+
+        RetentionService.collect_plots()
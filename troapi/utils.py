@@ -0,0 +1,16 @@
+import numpy as np
+
+
+def to_native_list(values):
+    """Convert numpy scalars in a list to python values, so they can be written to native array columns"""
+    return [value.item() if hasattr(value, "item") else value for value in values]
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great circle distance in km from a point to each of a set of points"""
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lons, dtype=float))
+
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+
+    return 6371.0 * 2 * np.arcsin(np.sqrt(a))
@@ -0,0 +1,39 @@
+"""Ingestion WORKER
+
+Runs the scheduled ingestion jobs. Web workers do not schedule anything, run a single worker next to them:
+
+    flask run_worker
+"""
+
+import logging
+import signal
+import threading
+
+from troapi.scheduler import scheduler
+
+
+def run():
+    # registers the scheduled jobs
+    from troapi import tasks  # noqa: F401
+
+    stopped = threading.Event()
+
+    def stop(signum, frame):
+        logging.info(f"[WORKER]: Received signal {signum}, stopping")
+        stopped.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logging.info("[WORKER]: Starting scheduler")
+    scheduler.start()
+
+    if not scheduler.running:
+        # Flask-APScheduler does not start outside the reloader when FLASK_DEBUG is set
+        logging.error("[WORKER]: Scheduler did not start, is FLASK_DEBUG set?")
+        return
+
+    stopped.wait()
+
+    scheduler.shutdown()
+    logging.info("[WORKER]: Scheduler stopped")